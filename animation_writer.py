@@ -0,0 +1,59 @@
+import cv2 as cv
+import numpy as np
+import pygame
+
+from queue import Queue
+from threading import Thread
+
+
+class AnimationWriter:
+    # フレームを溜め込まずに、生成した順に動画ファイルに書き込みます。エンコードは別スレッドで実施するので、シミュレーションと並行して進みます。
+    def __init__(self, path, size=(800, 640), fps=30, threaded=True, queue_size=8):
+        self.size = size
+        self.video_writer = cv.VideoWriter(path, cv.VideoWriter_fourcc(*'mp4v'), fps, size)
+
+        # キューの長さを制限するので、エンコードが遅れてもメモリーを使うのは数フレーム分だけです。
+        self.queue = Queue(queue_size) if threaded else None
+
+        # エンコードのスレッドで発生した例外です。writeかcloseで、呼び出し元に送出します。
+        self.exception = None
+        self.thread = Thread(target=self._write_images, daemon=True) if threaded else None
+
+        if self.thread:
+            self.thread.start()
+
+    def _write_image(self, image):
+        self.video_writer.write(cv.cvtColor(np.reshape(np.frombuffer(image, np.uint8), (self.size[1], self.size[0], 3)), cv.COLOR_RGB2BGR))
+
+    def _write_images(self):
+        while (image := self.queue.get()) is not None:
+            # 失敗した後も、writeがキューで止まらないように残りのフレームは読み捨てます。
+            if self.exception:
+                continue
+
+            try:
+                self._write_image(image)
+
+            except Exception as exception:
+                self.exception = exception
+
+    def write(self, surface):
+        image = pygame.image.tostring(surface, 'RGB')
+
+        if self.queue:
+            if self.exception:
+                raise self.exception
+
+            self.queue.put(image)
+        else:
+            self._write_image(image)
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+
+        self.video_writer.release()
+
+        if self.exception:
+            raise self.exception
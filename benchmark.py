@@ -0,0 +1,343 @@
+import json
+import math
+import numpy as np
+import os
+import platform
+
+# 結果はJSONで標準出力に書き込むので、pygameの起動メッセージは表示しないようにします。pygameをインポートする前に設定してください。
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+
+import pygame
+import pymunk
+import pymunk.pygame_util
+
+from funcy import first, repeatedly
+from itertools import count, product
+from game import CAR_COLLISION_TYPE, FPS, MAX_PHYSICS_THREADS, STAR_COLLISION_TYPE, Game, GameConfig
+from io import BytesIO
+from operator import itemgetter
+from players.protocol import JSON, PACKED, read_action, read_observation, write_action, write_observation
+from time import perf_counter
+from ui import Renderer, create_surface
+
+
+class _BenchmarkPlayer:
+    # 一番近いスターに向かうだけのプレイヤー。プロセス間通信を含めずに、シミュレーションの速度を計測するために使用します。
+    def __init__(self, name):
+        self.name = name
+
+    def send_observation(self, observation):
+        self.observation = observation
+
+    def receive_action(self):
+        return 1, 0, min(self.observation['stars'], key=itemgetter('position_length'))['position_angle']
+
+    def get_action(self, observation):
+        self.send_observation(observation)
+
+        return self.receive_action()
+
+
+def _get_warmup_actions(game):
+    # _BenchmarkPlayerと同じアクションを、観測の辞書を作らずに計算します。車が多いアリーナで、準備の時間を短くするためです。
+    stars = game.create_observation_arrays()['stars']
+
+    return tuple(map(lambda car_stars: (1, 0, float(car_stars[np.argmin(car_stars[:, 1]), 0])), stars))
+
+
+def _create_game(seed, config, warmup_steps=FPS * 10):
+    # 車や障害物が散らばって衝突が発生している状態で計測するために、少しゲームを進めておきます。
+    game = Game(tuple(map(lambda i: _BenchmarkPlayer(f'benchmark-{i}'), range(config.car_count))), seed=seed, config=config)
+
+    for _ in range(warmup_steps):
+        game.step(_get_warmup_actions(game))
+
+    return game
+
+
+def _measure(function, repeat):
+    starting_time = perf_counter()
+
+    for _ in range(repeat):
+        function()
+
+    return (perf_counter() - starting_time) / repeat
+
+
+def benchmark_game_init(seed, repeat, config):
+    return _measure(lambda: Game((), seed=seed, config=config), repeat)
+
+
+def benchmark_space_step(seed, repeat, config):
+    game = _create_game(seed, config)
+
+    return _measure(lambda: game.space.step(1 / FPS), repeat)
+
+
+def benchmark_game_step(seed, repeat, config):
+    game = _create_game(seed, config)
+
+    return _measure(game.step, repeat)
+
+
+def benchmark_collision_handlers(seed, repeat, config):
+    # Game._crashとGame._catchの、1ステップあたりの合計の時間を計測します。
+    game = _create_game(seed, config)
+    elapsed_times = []
+
+    def measure_handler(handler):
+        def measured_handler(arbiter, space, data):
+            starting_time = perf_counter()
+            result = handler(arbiter, space, data)
+            elapsed_times.append(perf_counter() - starting_time)
+
+            return result
+
+        return measured_handler
+
+    game.space.add_wildcard_collision_handler(CAR_COLLISION_TYPE).post_solve = measure_handler(game._crash)
+    game.space.add_wildcard_collision_handler(STAR_COLLISION_TYPE).begin = measure_handler(game._catch)
+
+    for _ in range(repeat):
+        game.step()
+
+    return sum(elapsed_times) / repeat
+
+
+def benchmark_create_observation(seed, repeat, config):
+    game = _create_game(seed, config)
+
+    return _measure(lambda: tuple(map(game.create_observation, game.cars)), repeat)
+
+
+def benchmark_create_observations(seed, repeat, config):
+    game = _create_game(seed, config)
+
+    return _measure(game.create_observations, repeat)
+
+
+def _benchmark_round_trip(seed, repeat, config, protocol):
+    # PlayerProxyとプレイヤーの間の、全ての車の観測とアクションのエンコードとデコードの時間を計測します。
+    observations = _create_game(seed, config).create_observations()
+
+    def round_trip():
+        for observation in observations:
+            observation_stream = BytesIO()
+            write_observation(observation_stream, observation, protocol)
+            read_observation(BytesIO(observation_stream.getvalue()), protocol)
+
+            action_stream = BytesIO()
+            write_action(action_stream, (1.0, 0.0, 0.5), protocol)
+            read_action(BytesIO(action_stream.getvalue()), protocol)
+
+    return _measure(round_trip, repeat)
+
+
+def benchmark_json_round_trip(seed, repeat, config):
+    return _benchmark_round_trip(seed, repeat, config, JSON)
+
+
+def benchmark_packed_round_trip(seed, repeat, config):
+    return _benchmark_round_trip(seed, repeat, config, PACKED)
+
+
+def benchmark_create_surface(seed, repeat, config):
+    game = _create_game(seed, config)
+
+    return _measure(lambda: create_surface(game.space, game.cars, game.players, game.actions), repeat)
+
+
+def benchmark_renderer(seed, repeat, config):
+    game = _create_game(seed, config)
+    renderer = Renderer(game.space)
+
+    return _measure(lambda: renderer.create_surface(game.cars, game.players, game.actions), repeat)
+
+
+BENCHMARKS = {
+    'game_init': (benchmark_game_init, 20),
+    'space_step': (benchmark_space_step, 300),
+    'game_step': (benchmark_game_step, 300),
+    'collision_handlers': (benchmark_collision_handlers, 300),
+    'create_observation': (benchmark_create_observation, 100),
+    'create_observations': (benchmark_create_observations, 100),
+    'json_round_trip': (benchmark_json_round_trip, 100),
+    'packed_round_trip': (benchmark_packed_round_trip, 100),
+    'create_surface': (benchmark_create_surface, 30),
+    'renderer': (benchmark_renderer, 30)
+}
+
+
+# アリーナの規模を変えた計測で、デフォルトで実行するベンチマークです。
+SCALING_BENCHMARK_NAMES = ('space_step', 'collision_handlers', 'game_step', 'create_observations')
+
+
+def get_scaled_config(arena_scale, batched_dynamics=True, physics_threads=1):
+    # 車と障害物とスターの数をarena_scale倍にします。アリーナの面積もarena_scale倍にするので、物体の密度は変わりません。
+    default = GameConfig()
+
+    return default._replace(car_count=default.car_count * arena_scale, obstacle_count=default.obstacle_count * arena_scale, star_count=default.star_count * arena_scale, arena_size=default.arena_size * math.sqrt(arena_scale), batched_dynamics=batched_dynamics, physics_threads=physics_threads)
+
+
+def _get_environment():
+    return {
+        'python': platform.python_version(),
+        'pymunk': pymunk.version,
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'machine': platform.machine(),
+        'system': platform.system()
+    }
+
+
+def _run_benchmarks(names, seed, scale, config):
+    # 描画の計測でもディスプレイは使用しません。
+    pygame.font.init()
+    pymunk.pygame_util.positive_y_is_up = True
+
+    def run_benchmark(name):
+        function, repeat = BENCHMARKS[name]
+        seconds = min(repeatedly(lambda: function(seed, max(int(repeat * scale), 1), config), 3))  # 3回計測して、最も速い値を採用します。
+
+        return {
+            'microseconds_per_step': seconds * 1000000,
+            'steps_per_second': 1 / seconds if seconds else None
+        }
+
+    return {name: run_benchmark(name) for name in names}
+
+
+def run_benchmarks(names, seed=0, scale=1, config=GameConfig()):
+    return {
+        'environment': _get_environment(),
+        'seed': seed,
+        'config': config._asdict(),
+        'results': _run_benchmarks(names, seed, scale, config)
+    }
+
+
+def run_scaling_benchmarks(names, arena_scales, seed=0, scale=1, batched_dynamics=True, physics_threads=(1,)):
+    # 物体の数に対して、処理時間がどのように増えるのかを計測します。物理シミュレーションのスレッドの数毎にも計測します。
+    def run_scaled_benchmarks(arena_scale_and_threads):
+        arena_scale, threads = arena_scale_and_threads
+        config = get_scaled_config(arena_scale, batched_dynamics, threads)
+
+        return {
+            'arena_scale': arena_scale,
+            'physics_threads': threads,
+            'config': config._asdict(),
+            'body_count': config.car_count * 5 + config.obstacle_count + config.star_count,
+            'results': _run_benchmarks(names, seed, scale, config)
+        }
+
+    return {
+        'environment': _get_environment(),
+        'seed': seed,
+        'scaling': tuple(map(run_scaled_benchmarks, product(arena_scales, physics_threads)))
+    }
+
+
+def check_determinism(seed, config, step_count=FPS * 10, run_count=3):
+    # 同じシードのゲームをrun_count回実行して、最後の状態が一致するかを調べます。スレッドが1つの場合の状態とも比較します。
+    def run(config):
+        return _create_game(seed, config, step_count).snapshot()
+
+    reference = run(config._replace(physics_threads=1))
+    snapshots = tuple(repeatedly(lambda: run(config), run_count))
+
+    return {
+        'physics_threads': config.physics_threads,
+        'config': config._asdict(),
+        'step_count': step_count,
+        'run_count': run_count,
+        'reproducible': all(map(lambda snapshot: snapshot == snapshots[0], snapshots)),
+        'matches_single_thread': all(map(lambda snapshot: snapshot == reference, snapshots))
+    }
+
+
+def check_batched_dynamics(seed, config, step_count=FPS * 10):
+    # タイヤや障害物やスターの速度をまとめて計算した場合と、物体毎のコールバックで計算した場合で、全てのステップの状態が一致するかを調べます。
+    def run(batched_dynamics):
+        game = _create_game(seed, config._replace(batched_dynamics=batched_dynamics, physics_threads=1), 0)
+
+        def step():
+            game.step(_get_warmup_actions(game))
+
+            return game.snapshot()
+
+        return tuple(repeatedly(step, step_count))
+
+    mismatched_steps = tuple(map(first, filter(lambda step_and_snapshots: step_and_snapshots[1] != step_and_snapshots[2], zip(count(1), run(True), run(False)))))
+
+    return {
+        'config': config._asdict(),
+        'step_count': step_count,
+        'identical': not mismatched_steps,
+        'mismatched_step_count': len(mismatched_steps),
+        'first_mismatched_step': first(mismatched_steps)
+    }
+
+
+def check_batched_dynamicses(arena_scales, seed=0):
+    # アリーナの規模毎に、check_batched_dynamicsを実行します。
+    return {
+        'environment': _get_environment(),
+        'seed': seed,
+        'batched_dynamics': tuple(map(lambda arena_scale: {'arena_scale': arena_scale, **check_batched_dynamics(seed, get_scaled_config(arena_scale))}, arena_scales))
+    }
+
+
+def check_determinisms(arena_scales, physics_threads, seed=0, batched_dynamics=True):
+    # アリーナの規模とスレッドの数の組み合わせ毎に、check_determinismを実行します。
+    def check_scaled_determinism(arena_scale_and_threads):
+        arena_scale, threads = arena_scale_and_threads
+
+        return {'arena_scale': arena_scale, **check_determinism(seed, get_scaled_config(arena_scale, batched_dynamics, threads))}
+
+    return {
+        'environment': _get_environment(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'determinism': tuple(map(check_scaled_determinism, product(arena_scales, physics_threads)))
+    }
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('names', metavar='BENCHMARK-NAME', nargs='*', help=f'benchmarks to run from {", ".join(BENCHMARKS.keys())} (default: all)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--scale', type=float, default=1, help='multiplier for the number of repetitions')
+    parser.add_argument('--output', help='write the results to the file instead of stdout')
+    parser.add_argument('--arena-scales', metavar='ARENA-SCALE', type=int, nargs='+', help=f'measure how the benchmarks scale with the number of bodies (default benchmarks: {", ".join(SCALING_BENCHMARK_NAMES)})')
+    parser.add_argument('--per-body-dynamics', action='store_true', help='measure with the per-body velocity callbacks instead of the batched dynamics')
+    parser.add_argument('--physics-threads', metavar='THREADS', type=int, nargs='+', choices=range(1, MAX_PHYSICS_THREADS + 1), default=(1,), help='numbers of threads for the physics solver (more than one only with --arena-scales or --check-determinism)')
+    parser.add_argument('--check-determinism', action='store_true', help='check whether seeded games reproduce with the physics threads instead of measuring')
+    parser.add_argument('--check-batched-dynamics', action='store_true', help='check whether the batched dynamics reproduce the per-body callbacks step by step instead of measuring')
+
+    args = parser.parse_args()
+
+    if set(args.names) - set(BENCHMARKS.keys()):
+        parser.error(f'unknown benchmark: {", ".join(sorted(set(args.names) - set(BENCHMARKS.keys())))}')
+
+    if len(args.physics_threads) > 1 and not (args.arena_scales or args.check_determinism):
+        parser.error('multiple --physics-threads require --arena-scales or --check-determinism')
+
+    if args.check_determinism and args.check_batched_dynamics:
+        parser.error('--check-determinism cannot be used with --check-batched-dynamics')
+
+    if args.check_batched_dynamics:
+        result = json.dumps(check_batched_dynamicses(args.arena_scales or (1,), seed=args.seed), indent=2)
+    elif args.check_determinism:
+        result = json.dumps(check_determinisms(args.arena_scales or (1,), args.physics_threads, seed=args.seed, batched_dynamics=not args.per_body_dynamics), indent=2)
+    elif args.arena_scales:
+        result = json.dumps(run_scaling_benchmarks(args.names or SCALING_BENCHMARK_NAMES, args.arena_scales, seed=args.seed, scale=args.scale, batched_dynamics=not args.per_body_dynamics, physics_threads=args.physics_threads), indent=2)
+    else:
+        result = json.dumps(run_benchmarks(args.names or tuple(BENCHMARKS.keys()), seed=args.seed, scale=args.scale, config=GameConfig(batched_dynamics=not args.per_body_dynamics, physics_threads=first(args.physics_threads))), indent=2)
+
+    if args.output:
+        with open(args.output, mode='w') as f:
+            print(result, file=f)
+    else:
+        print(result)
@@ -0,0 +1,146 @@
+import numpy as np
+
+from funcy import concat
+from game import Game, GameConfig
+from multiprocessing import Pipe, Process
+from operator import attrgetter
+from random import Random
+
+
+def create_observation_array(game):
+    # 全ての車の観測を、(車の数, 観測の次元)のfloat32の配列にします。値と順序はcreate_observationの辞書と同じです。
+    arrays = game.create_observation_arrays()
+    car_count = len(game.cars)
+
+    scores = np.array(tuple(map(attrgetter('score'), game.cars)), dtype=np.float64)
+    crash_energies = np.array(tuple(map(attrgetter('crash_energy'), game.cars)), dtype=np.float64) / 100000
+    others = ~np.eye(car_count, dtype=bool)
+    other_car_dimension = arrays['other_cars'].shape[-1]
+
+    my_cars = np.array(tuple(map(lambda my_car: tuple(concat(my_car['position'], map(my_car.__getitem__, ('angle', 'velocity_angle', 'velocity_length', 'steering_angle', 'steering_torque', 'score', 'crash_energy')))), map(game._get_my_car_observation, game.cars))), dtype=np.float64)
+    other_cars = np.concatenate((
+        arrays['other_cars'][others].reshape(car_count, car_count - 1, other_car_dimension),
+        np.broadcast_to(scores[np.newaxis, :], (car_count, car_count))[others].reshape(car_count, car_count - 1, 1),
+        np.broadcast_to(crash_energies[np.newaxis, :], (car_count, car_count))[others].reshape(car_count, car_count - 1, 1)
+    ), axis=-1)
+
+    return np.concatenate((my_cars, other_cars.reshape(car_count, -1), arrays['obstacles'].reshape(car_count, -1), arrays['stars'].reshape(car_count, -1)), axis=-1).astype(np.float32)
+
+
+class _Games:
+    # 複数のGameを同時に進めます。VectorEnvironmentのプロセス内、もしくはワーカー・プロセスの中で使用します。
+    def __init__(self, seeds, config):
+        # エピソード毎のシードは、Game毎のRandomから生成します。なので、ワーカーの数を変えても同じシードのゲームが実行されます。
+        self.config = config
+        self.randoms = tuple(map(Random, seeds))
+        self.games = [None] * len(seeds)
+        self.scores = np.zeros((len(seeds), 0))
+
+    def _reset_game(self, i):
+        self.games[i] = Game((), seed=self.randoms[i].randrange(2 ** 32), config=self.config)
+
+    def _get_scores(self):
+        return np.array(tuple(map(lambda game: tuple(map(attrgetter('score'), game.cars)), self.games)), dtype=np.float64)
+
+    def reset(self):
+        for i in range(len(self.games)):
+            self._reset_game(i)
+
+        self.scores = self._get_scores()
+
+        return np.stack(tuple(map(create_observation_array, self.games)))
+
+    def step(self, actions):
+        dones = np.array(tuple(map(lambda game, game_actions: game.step(game_actions.tolist()), self.games, actions)))
+
+        scores = self._get_scores()
+        rewards = scores - self.scores
+
+        # game_period_sec * FPSステップで終了したゲームは、新しいシードで作り直します。返す観測は、新しいゲームの最初の観測です。
+        for i in np.flatnonzero(dones):
+            self._reset_game(i)
+            scores[i] = 0
+
+        self.scores = scores
+
+        return np.stack(tuple(map(create_observation_array, self.games))), rewards.astype(np.float32), dones
+
+
+def _work(connection, seeds, config):
+    games = _Games(seeds, config)
+
+    while True:
+        command, argument = connection.recv()
+
+        if command == 'reset':
+            connection.send(games.reset())
+        elif command == 'step':
+            connection.send(games.step(argument))
+        elif command == 'close':
+            break
+
+    connection.close()
+
+
+class VectorEnvironment:
+    # K個の独立したGameを同時に進める、強化学習用の環境です。全ての車をアクションの配列で操作します。
+    # 観測は(K, 車の数, 観測の次元)、アクションは(K, 車の数, 3)（アクセル、ブレーキ、ステアリング）、報酬は(K, 車の数)のスコアの増分です。
+    # 観測の次元を固定するため、observation_countとobservation_radiusを指定したGameConfigには対応しません。
+    def __init__(self, environment_count, seed=None, worker_count=0, config=GameConfig()):
+        if config.observation_count is not None or config.observation_radius is not None:
+            raise ValueError('VectorEnvironment does not support observation_count or observation_radius')
+
+        seed_random = Random(seed)
+        seeds = tuple(map(lambda _: seed_random.randrange(2 ** 32), range(environment_count)))
+
+        self.environment_count = environment_count
+
+        # worker_countが0の場合はこのプロセスの中で、そうでなければワーカー・プロセスに分割して実行します。
+        if worker_count:
+            self.slices = tuple(map(lambda i: slice(environment_count * i // worker_count, environment_count * (i + 1) // worker_count), range(worker_count)))
+            self.connections = []
+            self.processes = []
+
+            for environment_slice in self.slices:
+                connection, worker_connection = Pipe()
+
+                process = Process(target=_work, args=(worker_connection, seeds[environment_slice], config), daemon=True)
+                process.start()
+
+                self.connections.append(connection)
+                self.processes.append(process)
+
+            self.games = None
+
+        else:
+            self.games = _Games(seeds, config)
+
+    def reset(self):
+        if self.games:
+            return self.games.reset()
+
+        for connection in self.connections:
+            connection.send(('reset', None))
+
+        return np.concatenate(tuple(map(lambda connection: connection.recv(), self.connections)))
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.float64)
+
+        if self.games:
+            return self.games.step(actions)
+
+        for connection, environment_slice in zip(self.connections, self.slices):
+            connection.send(('step', actions[environment_slice]))
+
+        observations, rewards, dones = zip(*map(lambda connection: connection.recv(), self.connections))
+
+        return np.concatenate(observations), np.concatenate(rewards), np.concatenate(dones)
+
+    def close(self):
+        if self.games:
+            return
+
+        for connection, process in zip(self.connections, self.processes):
+            connection.send(('close', None))
+            process.join()
@@ -0,0 +1,46 @@
+from itertools import combinations
+from math import inf, sqrt
+from statistics import NormalDist
+
+
+def get_order_intervals(player_stats, player_names, confidence=0.95, minimum_game_count=10):
+    # player_namesのプレイヤーの平均順位の信頼区間を、プレイヤー名から(下限, 上限)への辞書で返します。player_statsは、ResultsStore.get_player_statsの戻り値です。
+    # ゲームの数がminimum_game_count未満のプレイヤーは、分散が当てにならないので区間を無限にします。
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    stats = {name: (average_order, game_count, order_variance) for name, average_order, _, game_count, _, order_variance in player_stats}
+
+    def get_interval(name):
+        average_order, game_count, order_variance = stats.get(name, (None, 0, None))
+
+        if game_count < max(minimum_game_count, 2):
+            return -inf, inf
+
+        half_width = z * sqrt(order_variance / game_count)
+
+        return average_order - half_width, average_order + half_width
+
+    return {name: get_interval(name) for name in player_names}
+
+
+def get_unsettled_player_names(intervals, precision):
+    # 信頼区間の幅の半分がprecisionより大きくて、他のプレイヤーの区間と重なっているプレイヤーは、まだ順位が定まっていません。
+    # 区間がprecision以内に収まったプレイヤーと、他の全てのプレイヤーと区間が重ならないプレイヤーは、これ以上ゲームをしても順位が変わりません。
+    overlapping_names = set()
+
+    for (name_1, (lower_1, upper_1)), (name_2, (lower_2, upper_2)) in combinations(intervals.items(), 2):
+        if lower_1 <= upper_2 and lower_2 <= upper_1:
+            overlapping_names.update((name_1, name_2))
+
+    return tuple(filter(lambda name: name in overlapping_names and (intervals[name][1] - intervals[name][0]) / 2 > precision, intervals.keys()))
+
+
+def sample_players(random, player_names, unsettled_player_names, count):
+    # 順位が定まっていないプレイヤーを優先して選んで、残りの車には他のプレイヤーをランダムに選びます。スタート位置が偏らないように、最後に並べ替えます。
+    unsettled_player_names = tuple(filter(set(unsettled_player_names).__contains__, player_names))
+    settled_player_names = tuple(filter(lambda name: name not in unsettled_player_names, player_names))
+
+    names = random.sample(unsettled_player_names, min(count, len(unsettled_player_names)))
+    names.extend(random.sample(settled_player_names, count - len(names)))
+
+    return random.sample(names, len(names))
+
@@ -1,47 +1,104 @@
+import json
+import numpy as np
 import pygame
 import pymunk
 import sys
 
-from funcy import concat, distinct, first, mapcat, repeat, repeatedly
-from math import pi
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from funcy import concat, count, first, mapcat, repeat, repeatedly, take
+from math import atan2, cos, inf, pi, sin, sqrt
 from operator import attrgetter
-from player_proxy import PlayerProxy
+from player_proxy import create_player
 from random import Random
-from simulator import Car, Obstacle, Star
-from ui import create_surface
+from simulator import BatchedDynamics, Car, Obstacle, Star
+from spatial_index import GridIndex
+from ui import Renderer
 
 
 FPS = 30
 OBSTACLE_COUNT = 40
 STAR_COUNT = 2
 GAME_PERIOD_SEC = 60
+MAX_PHYSICS_THREADS = 2  # chipmunkは、これより多いスレッドを指定しても黙ってこの数に減らします。
+MAX_PLACEMENT_TRIALS = 10000  # 障害物やスターを置く位置を探す回数の上限です。
+
+
+# アリーナの設定です。arena_sizeは原点から壁までの距離です。デフォルトは、8台の車と上の定数のアリーナになります。
+# observation_countかobservation_radiusを指定した場合、観測には種類毎に近い順にobservation_count個まで、もしくはobservation_radius以内の物体だけを含めます。
+# ただし、プレイヤーが目指す物がなくならないように、スターは範囲外でも最も近い1つは必ず含めます。
+GameConfig = namedtuple('GameConfig', ('car_count', 'obstacle_count', 'star_count', 'arena_size', 'game_period_sec', 'observation_count', 'observation_radius', 'batched_dynamics', 'physics_threads', 'max_decision_interval'), defaults=(8, OBSTACLE_COUNT, STAR_COUNT, 1000, GAME_PERIOD_SEC, None, None, True, 1, 1))
+
+
+# 衝突の種類です。車体とタイヤ、スターにだけハンドラーを設定します。障害物と壁は0のままです。
+CAR_COLLISION_TYPE = 1
+STAR_COLLISION_TYPE = 2
 
 
 class Game:
-    @classmethod
-    def _crash(cls, arbiter, space, data):
-        for car in filter(lambda body: isinstance(body, Car), distinct(map(lambda body: body.car if hasattr(body, 'car') else body, map(lambda shape: shape.body, arbiter.shapes)))):
-            car.crash_energy = min(car.crash_energy + arbiter.total_ke / 2, 10 * FPS * 100000)
+    # 衝突のハンドラーは全ての接触で毎ステップ呼び出されるので、図形から車を辞書で引くだけにして、イテレーターは作りません。
+    def _crash(self, arbiter, space, data):
+        shape_a, shape_b = arbiter.shapes
 
-    @classmethod
-    def _catch(cls, arbiter, space, data):
-        car = first(filter(lambda body: isinstance(body, Car), distinct(map(lambda body: body.car if hasattr(body, 'car') else body, map(lambda shape: shape.body, arbiter.shapes)))))
+        car_a = self.shape_cars.get(shape_a)
+        car_b = self.shape_cars.get(shape_b)
+
+        if self.profiler:
+            self.profiler.count('crash_callbacks')
+
+        if car_a:
+            car_a.crash_energy = min(car_a.crash_energy + arbiter.total_ke / 2, 10 * FPS * 100000)
+
+        if car_b and car_b is not car_a:
+            car_b.crash_energy = min(car_b.crash_energy + arbiter.total_ke / 2, 10 * FPS * 100000)
+
+    def _catch(self, arbiter, space, data):
+        shape_a, shape_b = arbiter.shapes
+
+        car = self.shape_cars.get(shape_a) or self.shape_cars.get(shape_b)
+
+        if self.profiler:
+            self.profiler.count('catch_callbacks')
 
         if not car:
             return True
 
         car.score += 1
 
-        star = first(filter(lambda body: isinstance(body, Star), distinct(map(lambda shape: shape.body, arbiter.shapes))))
+        star = shape_a.body if shape_a.collision_type == STAR_COLLISION_TYPE else shape_b.body
         star.is_catched = True
 
         return False
 
+    def _get_placement_index(self):
+        # 配置に使用する索引は、物理シミュレーションで物体が動いた後に最初に使用する時に作り直します。
+        if self.placement_index is None:
+            self.placement_index = GridIndex(50)
+
+            for body in concat(self.cars, self.obstacles, self.stars):
+                self.placement_index.update(body)
+
+        return self.placement_index
+
+    def _update_placement_index(self, body):
+        if self.placement_index is not None:
+            self.placement_index.update(body)
+
     def _random_position(self, sigma):
-        return first(filter(lambda p: all(map(lambda b: (b.position - p).length >= 50, concat(self.cars, self.obstacles, self.stars))), filter(lambda p: 100 < p.length < 950, repeatedly(lambda: pymunk.Vec2d(self.game_random.gauss(0, sigma), 0).rotated(self.game_random.uniform(0, pi * 2))))))
+        # 近くの物体だけを索引から取得して判定します。乱数の使い方は変わらないので、同じシードなら同じ位置になります。sigmaは、arena_sizeが1000の場合の値です。
+        sigma *= self.config.arena_size / 1000
+
+        position = first(filter(lambda p: all(map(lambda b: (b.position - p).length >= 50, self._get_placement_index().query(p, 50))), filter(lambda p: 100 < p.length < self.config.arena_size - 50, repeatedly(lambda: pymunk.Vec2d(self.game_random.gauss(0, sigma), 0).rotated(self.game_random.uniform(0, pi * 2)), MAX_PLACEMENT_TRIALS))))
+
+        # アリーナに対して障害物やスターが多すぎると、空いている位置が見つかりません。
+        if position is None:
+            raise ValueError(f'no room for obstacles and stars in the arena of size {self.config.arena_size}')
+
+        return position
 
     def _reset_star_position(self, star):
         star.set_position_and_angle(self._random_position(300), self.game_random.uniform(0, pi * 2))
+        self._update_placement_index(star)
 
     def _append_wall(self, a, b):
         wall = pymunk.Body(body_type=pymunk.Body.STATIC)
@@ -52,63 +109,126 @@ class Game:
         self.space.add(wall, shape)
 
     def _append_car(self, position, angle):
-        car = Car(self.space)
+        car = Car(self.space, self.config.batched_dynamics)
         car.set_position_and_angle(position, angle)
         car.crash_energy = 0
         car.score = 0
 
+        self._update_placement_index(car)
+
         for shape in concat(car.shapes, mapcat(lambda tire: tire.shapes, (car.tire_lf, car.tire_rf, car.tire_lr, car.tire_rr))):
-            shape.collision_type = 1
+            shape.collision_type = CAR_COLLISION_TYPE
+            self.shape_cars[shape] = car
 
         self.cars.append(car)
 
     def _append_obstacle(self):
-        obstacle = Obstacle(self.space)
+        obstacle = Obstacle(self.space, self.config.batched_dynamics)
         obstacle.set_position_and_angle(self._random_position(500), self.game_random.uniform(0, pi * 2))
+        self._update_placement_index(obstacle)
 
         self.obstacles.append(obstacle)
 
     def _append_star(self):
-        star = Star(self.space)
+        star = Star(self.space, self.config.batched_dynamics)
 
         for shape in star.shapes:
-            shape.collision_type = 2
+            shape.collision_type = STAR_COLLISION_TYPE
 
         self._reset_star_position(star)
         star.is_catched = False
 
         self.stars.append(star)
 
-    def __init__(self, players, seed=None):
+    @classmethod
+    def _get_starting_positions(cls, car_count):
+        # 車は原点を囲む同心円上に配置します。k番目の円の半径は80 * (k + 1)で、8 * (k + 1)台まで配置できます。
+        for k in count():
+            ring_car_count = min(8 * (k + 1), car_count)
+
+            for i in range(ring_car_count):
+                yield pymunk.Vec2d(80 * (k + 1), 0).rotated(pi * 2 / ring_car_count * i), pi * 2 / ring_car_count * i
+
+            car_count -= ring_car_count
+
+            if car_count == 0:
+                break
+
+    def __init__(self, players, seed=None, concurrent_players=False, replay_writer=None, config=GameConfig(), profiler=None):
+        if not 1 <= config.physics_threads <= MAX_PHYSICS_THREADS:
+            raise ValueError(f'physics_threads must be between 1 and {MAX_PHYSICS_THREADS}: {config.physics_threads}')
+
+        if len(players) > config.car_count:
+            raise ValueError(f'too many players for {config.car_count} cars: {len(players)}')
+
+        # _random_positionは原点から100より遠く、壁から50より近くない位置を探すので、arena_sizeが150以下だと終了しません。
+        if config.arena_size <= 150:
+            raise ValueError(f'arena_size must be greater than 150: {config.arena_size}')
+
+        # 最も外側の同心円の半径は、各円の最初の車（角度0）のx座標の最大値です。車と壁の間には、_random_positionと同じく50の余裕を取ります。
+        if max(map(lambda position_and_angle: position_and_angle[0].x, self._get_starting_positions(config.car_count)), default=0) > config.arena_size - 50:
+            raise ValueError(f'{config.car_count} cars do not fit in the arena of size {config.arena_size}')
+
+        self.config = config
+
+        # 指定された場合は、ステップの段階毎の時間と衝突のハンドラーの呼び出し回数を計測します。
+        self.profiler = profiler
+
         self.game_random = Random(seed)
         self.control_random = Random(seed)
 
         self.players = players
 
+        # プレイヤーとの通信を並行して実施する場合は、プレイヤーの数だけスレッドを用意します。Windowsのパイプはselectorsで扱えないので、スレッドを使用します。
+        self.executor = ThreadPoolExecutor(len(players)) if concurrent_players and players else None
+
+        # 指定された場合は、全てのステップをリプレイとして記録します。
+        self.replay_writer = replay_writer
+
         self.elapse = 0
-        self.actions = repeat((0, 0, 0), len(players))
+        self.actions = [(0, 0, 0)] * len(players)
 
-        self.space = pymunk.Space()
+        # プレイヤーがアクションで判断の間隔を指定した場合、間隔が終わるまでのステップ数です。0の車のプレイヤーにだけ、観測を送信してアクションを問い合わせます。
+        self.decision_countdowns = [0] * config.car_count
 
-        self.space.add_wildcard_collision_handler(1).post_solve = self._crash
-        self.space.add_wildcard_collision_handler(2).begin = self._catch
+        # physics_threadsが2以上の場合は、chipmunkの拘束の計算を複数のスレッドで実施します。スレッドはMAX_PHYSICS_THREADSまでで、Windowsでは使用できません。
+        # スレッドの間で計算の順序が変わるので、同じシードでも同じ結果になるとは限りません。
+        if config.physics_threads > 1:
+            self.space = pymunk.Space(threaded=True)
+            self.space.threads = config.physics_threads
+        else:
+            self.space = pymunk.Space()
+
+        self.space.add_wildcard_collision_handler(CAR_COLLISION_TYPE).post_solve = self._crash
+        self.space.add_wildcard_collision_handler(STAR_COLLISION_TYPE).begin = self._catch
 
         self.cars = []
+        self.shape_cars = {}
         self.obstacles = []
         self.stars = []
 
-        for a, b in ((-1000, 1000), (1000, 1000)), ((1000, 1000), (1000, -1000)), ((1000, -1000), (-1000, -1000)), ((-1000, -1000), (-1000, 1000)):
+        self.placement_index = None
+
+        size = config.arena_size
+
+        for a, b in ((-size, size), (size, size)), ((size, size), (size, -size)), ((size, -size), (-size, -size)), ((-size, -size), (-size, size)):
             self._append_wall(a, b)
 
-        for position, angle in map(lambda i: (pymunk.Vec2d(80, 0).rotated(pi * 2 / 8 * i), pi * 2 / 8 * i), range(8)):
+        for position, angle in self._get_starting_positions(config.car_count):
             self._append_car(position, angle)
 
-        for _ in range(OBSTACLE_COUNT):
+        for _ in range(config.obstacle_count):
             self._append_obstacle()
 
-        for _ in range(STAR_COUNT):
+        for _ in range(config.star_count):
             self._append_star()
 
+        # タイヤや障害物やスターの速度の計算は、物体毎のPythonのコールバックではなく、全ての物体をまとめて実施します。
+        self.batched_dynamics = BatchedDynamics(self.space) if config.batched_dynamics else None
+
+        # restoreで空間に追加し直す、動的な物体の形状です。追加した順に並べます。
+        self.dynamic_shapes = tuple(filter(lambda shape: shape.body.body_type == pymunk.Body.DYNAMIC, self.space.shapes))
+
     @classmethod
     def _normalize_angle(cls, angle):
         return (angle + pi * 2) % (pi * 2)
@@ -153,6 +273,9 @@ class Game:
         }
 
     def create_observation(self, my_car):
+        if self._is_observation_limited():
+            return self._create_nearby_observation(self._get_nearby_bodies(self._create_observation_indices(), my_car), my_car)
+
         return {
             'my_car': self._get_my_car_observation(my_car),
             'other_cars': tuple(map(lambda other_car: self._get_other_car_observation(other_car, my_car), filter(lambda car: car != my_car, self.cars))),
@@ -160,17 +283,246 @@ class Game:
             'stars': tuple(map(lambda star: self._get_obstacle_or_star_observation(star, my_car), self.stars))
         }
 
+    def _is_observation_limited(self):
+        return self.config.observation_count is not None or self.config.observation_radius is not None
+
+    def _create_observation_indices(self):
+        # 物体はステップ毎に動くので、索引は観測を作成する度に作り直します。
+        def create_index(bodies):
+            index = GridIndex(100)
+
+            for body in bodies:
+                index.update(body)
+
+            return index
+
+        return create_index(self.cars), create_index(self.obstacles), create_index(self.stars)
+
+    def _get_nearby_bodies(self, observation_indices, my_car):
+        count = self.config.observation_count
+        radius = self.config.observation_radius if self.config.observation_radius is not None else inf
+
+        def query(index, extra_count=0):
+            if count is None:
+                return index.query_within(my_car.position, radius)
+
+            return index.query_nearest(my_car.position, count + extra_count, radius)
+
+        car_index, obstacle_index, star_index = observation_indices
+
+        # 範囲内にスターがない場合は、最も近いスターだけを観測に含めます。
+        stars = query(star_index) or star_index.query_nearest(my_car.position, 1)
+
+        # 自分の車も含まれるので、車は1台多く取得してから自分の車を取り除きます。
+        return (
+            tuple(take(count if count is not None else len(self.cars), filter(lambda car: car != my_car, query(car_index, 1)))),
+            query(obstacle_index),
+            stars
+        )
+
+    def _create_nearby_observation(self, nearby_bodies, my_car):
+        other_cars, obstacles, stars = nearby_bodies
+
+        return {
+            'my_car': self._get_my_car_observation(my_car),
+            'other_cars': tuple(map(lambda other_car: self._get_other_car_observation(other_car, my_car), other_cars)),
+            'obstacles': tuple(map(lambda obstacle: self._get_obstacle_or_star_observation(obstacle, my_car), obstacles)),
+            'stars': tuple(map(lambda star: self._get_obstacle_or_star_observation(star, my_car), stars))
+        }
+
+    @classmethod
+    def _map_vectors(cls, f, xs, ys):
+        return np.fromiter(map(f, xs.ravel().tolist(), ys.ravel().tolist()), dtype=np.float64, count=xs.size).reshape(xs.shape)
+
+    @classmethod
+    def _get_angles(cls, xs, ys):
+        # np.arctan2はmath.atan2と丸め誤差が異なって、シードが同じでもゲームの結果が変わってしまいます。なので、pymunk.Vec2dのangleと同じ計算をします。長さが0のベクトルの角度は0です。
+        return cls._map_vectors(lambda x, y: atan2(y, x) if x ** 2 + y ** 2 != 0 else 0, xs, ys)
+
+    @classmethod
+    def _get_lengths(cls, xs, ys):
+        # 同様に、pymunk.Vec2dのlengthと同じ計算をします（NumPyのxs ** 2は、Pythonのx ** 2と丸め誤差が異なる場合があります）。
+        return cls._map_vectors(lambda x, y: sqrt(x ** 2 + y ** 2), xs, ys)
+
+    @classmethod
+    def _normalize_relative_angles(cls, angles):
+        result = np.mod(angles + pi * 2, pi * 2)
+
+        return np.where(result <= pi, result, result - pi * 2)
+
+    def create_observation_arrays(self):
+        # 全ての物体の位置と速度をNumPyの配列に集めて、全ての車から見た相対的な極座標を一度に計算します。
+        car_positions = np.array(tuple(map(attrgetter('position'), self.cars)), dtype=np.float64).reshape(-1, 2)
+        car_velocities = np.array(tuple(map(attrgetter('velocity'), self.cars)), dtype=np.float64).reshape(-1, 2)
+        car_angles = np.array(tuple(map(attrgetter('angle'), self.cars)), dtype=np.float64)
+        steering_angles = np.array(tuple(map(lambda car: car.tire_lf.angle, self.cars)), dtype=np.float64)
+        obstacle_positions = np.array(tuple(map(attrgetter('position'), self.obstacles)), dtype=np.float64).reshape(-1, 2)
+        star_positions = np.array(tuple(map(attrgetter('position'), self.stars)), dtype=np.float64).reshape(-1, 2)
+
+        # pymunk.Vec2dのrotatedと同じ値になるように、三角関数はmathで計算します。
+        cosines = np.array(tuple(map(lambda car: cos(-car.angle), self.cars)), dtype=np.float64)[:, np.newaxis]
+        sines = np.array(tuple(map(lambda car: sin(-car.angle), self.cars)), dtype=np.float64)[:, np.newaxis]
+
+        def get_rotated(vectors):
+            return vectors[..., 0] * cosines - vectors[..., 1] * sines, vectors[..., 0] * sines + vectors[..., 1] * cosines
+
+        def get_polar_positions(positions):
+            vectors = positions[np.newaxis, :, :] - car_positions[:, np.newaxis, :]
+
+            return np.stack((self._normalize_relative_angles(self._get_angles(*get_rotated(vectors))), self._get_lengths(vectors[..., 0], vectors[..., 1])), axis=-1)
+
+        relative_velocity_xs, relative_velocity_ys = get_rotated(car_velocities[np.newaxis, :, :] - car_velocities[:, np.newaxis, :])
+
+        return {
+            'other_cars': np.concatenate((
+                get_polar_positions(car_positions),
+                np.stack((
+                    self._normalize_relative_angles(car_angles[np.newaxis, :] - car_angles[:, np.newaxis]),
+                    self._normalize_relative_angles(self._get_angles(relative_velocity_xs, relative_velocity_ys)),
+                    self._get_lengths(relative_velocity_xs, relative_velocity_ys) / FPS,
+                    np.broadcast_to(self._normalize_relative_angles(steering_angles - car_angles)[np.newaxis, :], (len(self.cars), len(self.cars)))
+                ), axis=-1)
+            ), axis=-1),
+            'obstacles': get_polar_positions(obstacle_positions),
+            'stars': get_polar_positions(star_positions)
+        }
+
+    def _create_observation_from_lists(self, observation_lists, i):
+        if self._is_observation_limited():
+            return self._create_nearby_observation(observation_lists[i], self.cars[i])
+
+        return self._create_observation_from_arrays(observation_lists, i)
+
+    def _create_observation_from_arrays(self, observation_lists, i):
+        other_cars, obstacles, stars = observation_lists
+        my_car = self.cars[i]
+
+        # スコアとクラッシュ・エネルギーは、この時点の値を使用します。
+        return {
+            'my_car': self._get_my_car_observation(my_car),
+            'other_cars': tuple(map(lambda j: dict(zip(('position_angle', 'position_length', 'angle', 'velocity_angle', 'velocity_length', 'steering_angle'), other_cars[i][j]), score=self.cars[j].score, crash_energy=self.cars[j].crash_energy / 100000), filter(lambda j: j != i, range(len(self.cars))))),
+            'obstacles': tuple(map(lambda values: dict(zip(('position_angle', 'position_length'), values)), obstacles[i])),
+            'stars': tuple(map(lambda values: dict(zip(('position_angle', 'position_length'), values)), stars[i]))
+        }
+
+    def _create_observation_lists(self):
+        # 観測する物体を制限する場合は、配列ではなく、車毎の近くの物体のリストを返します。
+        if self._is_observation_limited():
+            observation_indices = self._create_observation_indices()
+
+            return tuple(map(lambda car: self._get_nearby_bodies(observation_indices, car), self.cars))
+
+        arrays = self.create_observation_arrays()
+
+        return arrays['other_cars'].tolist(), arrays['obstacles'].tolist(), arrays['stars'].tolist()
+
+    def create_observations(self):
+        # create_observationを全ての車に対して実行した場合と同じ値を返します。
+        observation_lists = self._create_observation_lists()
+
+        return tuple(map(lambda i: self._create_observation_from_lists(observation_lists, i), range(len(self.cars))))
+
     @classmethod
     def _clip(cls, value, min_value, max_value):
         return min(max(value, min_value), max_value)
 
-    def step(self):
+    def _get_decision_interval(self, action):
+        # アクションの4番目の値は、そのアクションを繰り返すステップ数です。1からmax_decision_intervalの範囲に丸めます。
+        return int(self._clip(action[3], 1, self.config.max_decision_interval)) if len(action) > 3 else 1
+
+    def _is_deciding(self, i, player):
+        return player and not self.decision_countdowns[i]
+
+    def _repeat_action(self, i, previous_actions):
+        # 判断の間隔の途中の車は、観測を作成せずに前回の正規化したアクションを繰り返します。ゆらぎは、通常と同じくステップ毎に加えます。
+        self.decision_countdowns[i] -= 1
+
+        return previous_actions[i]
+
+    def _decide_action(self, i, action):
+        self.decision_countdowns[i] = self._get_decision_interval(action) - 1
+
+        return action
+
+    def _get_actions(self, observation_lists, previous_actions):
+        for i, player in zip(range(len(self.cars)), concat(self.players, repeat(None))):
+            if player and self.decision_countdowns[i]:
+                yield self._repeat_action(i, previous_actions)
+                continue
+
+            # ここまでの時間は、前の車のアクションの処理の時間です。
+            if self.profiler:
+                self.profiler.lap('actions')
+
+            # 観測は、前の車のアクションを処理した後のスコアやクラッシュ・エネルギーを反映させるために、アクションを取得する直前に作成します。
+            observation = self._create_observation_from_lists(observation_lists, i) if player else None
+
+            if self.profiler:
+                self.profiler.lap('observation')
+
+            action = self._decide_action(i, player.get_action(observation)) if player else (0, 0, 0)
+
+            if self.profiler:
+                self.profiler.lap('players')
+
+            yield action
+
+    def _get_actions_concurrently(self, observation_lists, previous_actions):
+        players = tuple(take(len(self.cars), concat(self.players, repeat(None))))
+
+        # 全てのプレイヤーに観測を送信してから、応答を並行して待ちます。なので、ステップの時間は最も遅いプレイヤーの時間になります。制限時間は、プレイヤー毎に観測を送信した時点から計測します。
+        for i, player in enumerate(players):
+            if self._is_deciding(i, player):
+                observation = self._create_observation_from_lists(observation_lists, i)
+
+                if self.profiler:
+                    self.profiler.lap('observation')
+
+                player.send_observation(observation)
+
+                if self.profiler:
+                    self.profiler.lap('players')
+
+        def receive_action(i, player):
+            if not player:
+                return 0, 0, 0
+
+            if self.decision_countdowns[i]:
+                return self._repeat_action(i, previous_actions)
+
+            return self._decide_action(i, player.receive_action())
+
+        # プロセス内のプレイヤーは標準エラー出力をプロセス全体で切り替えるので、スレッドでは実行しません。他のプレイヤーの応答を待つ間に、このスレッドで実行します。
+        futures = tuple(map(lambda i, player: None if getattr(player, 'in_process', False) else self.executor.submit(receive_action, i, player), range(len(players)), players))
+        actions = tuple(map(lambda i, player, future: future.result() if future else receive_action(i, player), range(len(players)), players, futures))
+
+        if self.profiler:
+            self.profiler.lap('players')
+
+        return actions
+
+    def step(self, actions=None):
+        if self.profiler:
+            self.profiler.start_step()
+
         self.elapse += 1
+
+        previous_actions = self.actions
         self.actions = []
 
-        for car, player in zip(self.cars, concat(self.players, repeat(None))):
-            # アクションを取得します。
-            acceleration, braking, steering = player.get_action(self.create_observation(car)) if player else (0, 0, 0)
+        # 強化学習の環境などからアクションが渡された場合は、観測を作成せずに、プレイヤーにも問い合わせません。
+        if actions is None:
+            # 判断するプレイヤーがいないステップでは、観測を作成しません。
+            observation_lists = self._create_observation_lists() if any(map(lambda i, player: self._is_deciding(i, player), range(len(self.cars)), self.players)) else None
+
+            if self.profiler:
+                self.profiler.lap('observation')
+
+            actions = (self._get_actions_concurrently if self.executor else self._get_actions)(observation_lists, previous_actions)
+
+        for car, action in zip(self.cars, actions):
+            # アクションを取得します。判断の間隔は、_get_actionsで処理済みです。
+            acceleration, braking, steering = action[:3]
 
             # アクションを正規化します。
             acceleration = self._clip(acceleration, -1, 1)
@@ -195,70 +547,269 @@ class Game:
             car.brake(braking * 200000)
             car.steer(steering * 20000)
 
+        if self.profiler:
+            self.profiler.lap('actions')
+
         self.space.step(1 / FPS)
+        self.placement_index = None
+
+        if self.profiler:
+            self.profiler.lap('space_step')
 
         for star in filter(lambda star: star.is_catched, self.stars):
             self._reset_star_position(star)
             star.is_catched = False
 
-        return self.elapse >= GAME_PERIOD_SEC * FPS  # ゲームはGAME_PERIOD_SECで終了します。
+        if self.profiler:
+            self.profiler.lap('star_reset')
+
+        if self.replay_writer:
+            self.replay_writer.write(self)
+
+        if self.profiler:
+            self.profiler.lap('replay')
+
+        return self.elapse >= self.config.game_period_sec * FPS  # ゲームはgame_period_secで終了します。
+
+    def _get_dynamic_bodies(self):
+        return concat(mapcat(lambda car: (car, car.tire_lf, car.tire_rf, car.tire_lr, car.tire_rr), self.cars), self.obstacles, self.stars)
+
+    def close(self):
+        # プレイヤーとの通信用のスレッドを終了させます。ゲームが終わったら呼び出してください。
+        if self.executor:
+            self.executor.shutdown()
+
+    def snapshot(self):
+        # 現在のゲームの状態を保存します。物体の状態と、車やスターに追加した属性、2つのRandomの状態を含みます。
+        # pymunkのAPIでは取得できない、接触とジョイントのウォーム・スタート用の撃力は含まれないので、restoreではそれらを消去します。
+        return (
+            self.elapse,
+            tuple(self.actions),
+            tuple(self.decision_countdowns),
+            tuple(map(lambda body: (body.angle, body.position, body.velocity, body.angular_velocity, body.force, body.torque), self._get_dynamic_bodies())),
+            tuple(map(lambda car: (car.score, car.crash_energy), self.cars)),
+            tuple(map(attrgetter('is_catched'), self.stars)),
+            self.game_random.getstate(),
+            self.control_random.getstate()
+        )
+
+    def restore(self, snapshot):
+        # Spaceを作り直さずに、snapshotで保存した状態に戻します。
+        # 接触とジョイントのウォーム・スタート用の撃力は消去するので、restoreしてからのステップは、snapshotの時点からそのまま続けた場合とは一致しません。
+        elapse, actions, decision_countdowns, body_states, car_states, star_states, game_random_state, control_random_state = snapshot
+
+        self.elapse = elapse
+        self.actions = list(actions)
+        self.decision_countdowns = list(decision_countdowns)
+
+        for body, (angle, position, velocity, angular_velocity, force, torque) in zip(self._get_dynamic_bodies(), body_states):
+            # 物体に残っている、前のステップの位置の補正用の速度を、時間0で位置を積分して消去します。
+            pymunk.Body.update_position(body, 0)
+
+            # 重心が原点にない物体（車）は角度を設定すると位置が変わってしまうので、角度、位置の順に設定します。
+            body.angle = angle
+            body.position = position
+            body.velocity = velocity
+            body.angular_velocity = angular_velocity
+            body.force = force
+            body.torque = torque
+
+        # 動的な物体の形状を取り除いて追加し直して、キャッシュされている接触を消去します。空間索引が復元した位置から作られるように、物体の状態を設定した後に実施します。
+        # ジョイントは、作り直して撃力を0にします。ただし、chipmunkは追加し直した形状に新しいIDを割り当てて、IDによって接触を処理する順序が変わる場合があるので、同じsnapshotからの結果が完全に一致するとは限りません。
+        self.space.remove(*mapcat(attrgetter('joints'), self.cars), *self.dynamic_shapes)
+
+        for car in self.cars:
+            car.create_joints()
+
+        self.space.add(*self.dynamic_shapes, *mapcat(attrgetter('joints'), self.cars))
+
+        # 物体は取り除かないので、BatchedDynamicsが最後に積分される物体で計算する順序は変わりません。
+        assert self.batched_dynamics is None or self.batched_dynamics.is_last_body(self.space)
+
+        for car, (score, crash_energy) in zip(self.cars, car_states):
+            car.score = score
+            car.crash_energy = crash_energy
+
+        for star, is_catched in zip(self.stars, star_states):
+            star.is_catched = is_catched
+
+        self.placement_index = None
+
+        self.game_random.setstate(game_random_state)
+        self.control_random.setstate(control_random_state)
 
     def create_surface(self):
-        return create_surface(self.space, self.cars, self.players, self.actions)
+        # 描画の準備は最初の1回だけ実施します。
+        if not hasattr(self, 'renderer'):
+            self.renderer = Renderer(self.space)
+
+        return self.renderer.create_surface(self.cars, self.players, self.actions)
+
+
+def _create_players(program_names, player_pool):
+    # 途中でプレイヤーの作成に失敗した場合は、作成済みのプレイヤーを終了させます。
+    players = []
+
+    try:
+        for program_name in program_names:
+            players.append(player_pool.create_player(program_name) if player_pool else create_player(program_name))
 
+    except BaseException:
+        _release_players(players, None)
+        raise
 
-def play(program_names, seed, screen, need_images=False):
-    images = []
+    return tuple(players)
 
-    game = Game(tuple(map(PlayerProxy, program_names)), seed=seed)
+
+def _release_players(players, player_pool):
+    # プレイヤーのプールを使用している場合は、ゲームが終わったプレイヤーをプールに戻します。そうでなければ、プレイヤーのプロセスを終了させます。
+    for player in players:
+        if player_pool:
+            player_pool.release(player)
+        else:
+            player.done()
+
+
+def play(program_names, seed, screen, animation_writer=None, concurrent_players=False, replay_writer=None, config=GameConfig(), player_pool=None, profiler=None):
+    players = _create_players(program_names, player_pool)
     done = False
 
-    while not done:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                sys.exit(0)
+    try:
+        game = Game(players, seed=seed, concurrent_players=concurrent_players, replay_writer=replay_writer, config=config, profiler=profiler)
 
-        done = game.step()
-        surface = game.create_surface()
+        try:
+            while not done:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        sys.exit(0)
 
-        screen.blit(surface, (0, 0))
-        pygame.display.flip()
+                done = game.step()
+                surface = game.create_surface()
 
-        if need_images:
-            images.append(pygame.image.tostring(surface, 'RGB'))
+                screen.blit(surface, (0, 0))
+                pygame.display.flip()
 
-    return map(attrgetter('name'), game.players), map(attrgetter('score'), game.cars), images
+                # フレームは溜め込まずに、その都度エンコーダーに渡します。
+                if animation_writer:
+                    animation_writer.write(surface)
 
+        finally:
+            game.close()
 
-if __name__ == '__main__':
-    import cv2 as cv
-    import numpy as np
+    except BaseException:
+        # 途中で終了したゲームのプレイヤーは、通信の途中かもしれないのでプールには戻さずに終了させます。
+        _release_players(players, None)
+        raise
+
+    telemetries = tuple(map(lambda player: player.get_telemetry(), game.players))
+    _release_players(game.players, player_pool)
+
+    return map(attrgetter('name'), game.players), map(attrgetter('score'), game.cars), telemetries
+
+
+def play_headless(program_names, seed, concurrent_players=False, replay_writer=None, config=GameConfig(), player_pool=None, profiler=None):
+    # 画面を使わずに、シミュレーションだけを最高速で実行します。動画が必要な場合は、リプレイを記録してreplay.pyで描画してください。
+    players = _create_players(program_names, player_pool)
+
+    try:
+        game = Game(players, seed=seed, concurrent_players=concurrent_players, replay_writer=replay_writer, config=config, profiler=profiler)
+
+        try:
+            while not game.step():
+                pass
 
+        finally:
+            game.close()
+
+    except BaseException:
+        _release_players(players, None)
+        raise
+
+    telemetries = tuple(map(lambda player: player.get_telemetry(), game.players))
+    _release_players(game.players, player_pool)
+
+    return map(attrgetter('name'), game.players), map(attrgetter('score'), game.cars), telemetries
+
+
+def add_game_config_arguments(parser):
+    # self_driving.pyなどのコマンドラインでも、同じ引数でアリーナを設定できるようにします。
+    default = GameConfig()
+
+    parser.add_argument('--cars', type=int, default=default.car_count, help='number of cars')
+    parser.add_argument('--obstacles', type=int, default=default.obstacle_count, help='number of obstacles')
+    parser.add_argument('--stars', type=int, default=default.star_count, help='number of stars')
+    parser.add_argument('--arena-size', type=float, default=default.arena_size, help='distance from the center to the walls')
+    parser.add_argument('--period', type=float, default=default.game_period_sec, help='game period in seconds')
+    parser.add_argument('--observation-count', type=int, help='observe only the nearest cars, obstacles and stars up to this number of each kind')
+    parser.add_argument('--observation-radius', type=float, help='observe only the cars, obstacles and stars within this distance (the nearest star is always observed)')
+    parser.add_argument('--per-body-dynamics', action='store_true', help='update the tires, obstacles and stars in per-body callbacks instead of one batched pass')
+    parser.add_argument('--max-decision-interval', type=int, default=default.max_decision_interval, help='maximum number of steps a player may repeat an action without receiving observations')
+    parser.add_argument('--physics-threads', type=int, choices=range(1, MAX_PHYSICS_THREADS + 1), default=default.physics_threads, help=f'number of threads for the physics solver (up to {MAX_PHYSICS_THREADS}, not available on Windows; seeded games may not reproduce)')
+
+
+def get_game_config(args):
+    return GameConfig(args.cars, args.obstacles, args.stars, args.arena_size, args.period, args.observation_count, args.observation_radius, not args.per_body_dynamics, args.physics_threads, args.max_decision_interval)
+
+
+if __name__ == '__main__':
+    from animation_writer import AnimationWriter
     from argparse import ArgumentParser
+    from profiler import StepProfiler
+    from replay import ReplayWriter
     # from subprocess import run
 
     parser = ArgumentParser()
-    parser.add_argument('program_names', metavar='PROGRAM-NAME', nargs='+', help='player program\'s name')
+    parser.add_argument('program_names', metavar='PROGRAM-NAME', nargs='+', help='player program\'s name, or MODULE:CLASS to run the player in this process')
     parser.add_argument('--seed', nargs='?', help='random seed')
     parser.add_argument('--animation', action='store_true', help='generate GIF animation')
+    parser.add_argument('--headless', action='store_true', help='run without display')
+    parser.add_argument('--concurrent-players', action='store_true', help='wait for all players\' actions concurrently')
+    parser.add_argument('--replay', metavar='REPLAY-PATH', help='record replay to the file')
+    parser.add_argument('--telemetry', metavar='TELEMETRY-PATH', help='write the players\' response times and payload sizes to the JSON file')
+    parser.add_argument('--profile', metavar='PROFILE-PATH', help='write the time spent in each phase of the steps to the JSON file')
+    add_game_config_arguments(parser)
 
     args = parser.parse_args()
 
-    pygame.init()
-    pymunk.pygame_util.positive_y_is_up = True
+    if args.headless and args.animation:
+        parser.error('--animation cannot be used with --headless')
 
-    pygame.display.set_caption('self driving')
-    screen = pygame.display.set_mode((800, 640))
+    config = get_game_config(args)
 
-    names, scores, images = play(args.program_names, args.seed, screen, need_images=args.animation)
+    replay_writer = ReplayWriter(args.replay) if args.replay else None
+    profiler = StepProfiler() if args.profile else None
+
+    try:
+        if args.headless:
+            names, scores, telemetries = play_headless(args.program_names, args.seed, concurrent_players=args.concurrent_players, replay_writer=replay_writer, config=config, profiler=profiler)
+
+        else:
+            pygame.init()
+            pymunk.pygame_util.positive_y_is_up = True
+
+            pygame.display.set_caption('self driving')
+            screen = pygame.display.set_mode((800, 640))
+
+            animation_writer = AnimationWriter('game.mp4') if args.animation else None
+
+            names, scores, telemetries = play(args.program_names, args.seed, screen, animation_writer=animation_writer, concurrent_players=args.concurrent_players, replay_writer=replay_writer, config=config, profiler=profiler)
+
+            if animation_writer:
+                animation_writer.close()
+
+    finally:
+        # ゲームが例外で終了した場合も、それまでのリプレイを書き出します。
+        if replay_writer:
+            replay_writer.close()
+
+    if args.telemetry:
+        with open(args.telemetry, mode='w') as f:
+            json.dump(telemetries, f, indent=2)
+
+    if profiler:
+        profiler.write_report(args.profile)
 
     # run('taskkill /im TestDrive.exe /f /t')
 
     for name, score in zip(names, scores):
         print(f'{name}\t{score}')
-
-    if args.animation:
-        animation_writer = cv.VideoWriter('game.mp4', cv.VideoWriter_fourcc(*'mp4v'), 30, (800, 640))
-        for image in map(lambda image: cv.cvtColor(np.reshape(np.frombuffer(image, np.uint8), (640, 800, 3)), cv.COLOR_RGB2BGR), images):
-            animation_writer.write(image)
-        animation_writer.release()
@@ -1,41 +1,136 @@
-import json
+import numpy as np
 import os
+import sys
 
-from funcy import concat, first, repeat, rest
+from collections import defaultdict
+from contextlib import redirect_stderr
+from funcy import cat, concat, first, repeat, rest
+from importlib import import_module
+from players.protocol import JSON, PROTOCOLS, parse_action_frame, read_action_frame, write_new_game, write_observation
 from subprocess import PIPE, Popen
-from time import time
+from time import perf_counter, time
+
+
+# 経過時間が制限時間のこの割合を超えた呼び出しを、制限時間に近い呼び出しとして数えます。
+NEAR_LIMIT_RATIO = 0.8
+
+
+def _summarize(values):
+    if not values:
+        return None
+
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'max': float(max(values))
+    }
+
+
+class Telemetry:
+    # アクションの取得毎に、観測の書き込み、応答の待ち、アクションの解析の時間と、観測とアクションのバイト数を記録します。
+    def __init__(self):
+        self.records = []
+
+    def record(self, write_time, wait_time, parse_time, observation_size, action_size, elapsed_time, time_limit):
+        self.records.append((write_time, wait_time, parse_time, observation_size, action_size, elapsed_time, time_limit))
+
+    def summarize(self):
+        write_times, wait_times, parse_times, observation_sizes, action_sizes, elapsed_times, time_limits = map(list, zip(*self.records)) if self.records else repeat([], 7)
+
+        return {
+            'calls': len(self.records),
+            'write_time': _summarize(write_times),
+            'wait_time': _summarize(wait_times),
+            'parse_time': _summarize(parse_times),
+            'observation_bytes': _summarize(observation_sizes),
+            'action_bytes': _summarize(action_sizes),
+            'total_bytes': sum(observation_sizes) + sum(action_sizes),
+            'near_limit_calls': sum(map(lambda elapsed_time, time_limit: elapsed_time > time_limit * NEAR_LIMIT_RATIO, elapsed_times, time_limits))
+        }
 
 
 class PlayerProxy:
+    in_process = False
+
     def __init__(self, program_name):
+        self.program_name = program_name
         self.name = program_name.replace('.bat', '')
 
         self.time_over = False
         self.time_limits = concat((30 * 2,), repeat(0.5 * 2))
 
+        # 最初はJSONで通信します。プレイヤーが対応しているプロトコルを要求してきたら、以降はそのプロトコルに切り替えます。
+        self.protocol = JSON
+
+        # プレイヤーが'reusable'を返してきたら、ゲームの後にプロセスを再利用できます。
+        self.reusable = False
+
+        self.telemetry = Telemetry()
+
         self.stderr = open(os.path.join('.', 'players', f'{program_name}-log.txt'), mode='a')
-        self.process = Popen((os.path.join('.', program_name),), cwd=os.path.join('.', 'players'), shell=True, stdin=PIPE, stdout=PIPE, stderr=self.stderr, universal_newlines=True)
+        self.process = Popen((os.path.join('.', program_name),), cwd=os.path.join('.', 'players'), shell=True, stdin=PIPE, stdout=PIPE, stderr=self.stderr)
 
-    def get_action(self, observation):
+    def send_observation(self, observation):
+        if self.time_over:
+            return
+
+        writing_time = perf_counter()
+        self.observation_size = write_observation(self.process.stdin, observation, self.protocol)
+        self.write_time = perf_counter() - writing_time
+
+        self.starting_time = time()
+
+    def receive_action(self):
         if self.time_over:
             return 0, 0, 0
 
-        self.process.stdin.write(f'{json.dumps(observation)}\n')
-        self.process.stdin.flush()
+        waiting_time = perf_counter()
+        action_frame = read_action_frame(self.process.stdout, self.protocol)
+        wait_time = perf_counter() - waiting_time
 
-        starting_time = time()
-        action_string = self.process.stdout.readline()
-        elapsed_time = time() - starting_time
+        elapsed_time = time() - self.starting_time
+        time_limit = first(self.time_limits)
 
-        if elapsed_time > first(self.time_limits):
+        if elapsed_time > time_limit:
             self.time_over = True
             self.stderr.write(f'*** time over. elapsed time: {elapsed_time} sec. ***\n')
 
         self.time_limits = rest(self.time_limits)
 
-        action = json.loads(action_string)
+        parsing_time = perf_counter()
+        action = parse_action_frame(action_frame, self.protocol)
+        parse_time = perf_counter() - parsing_time
 
-        return action['acceleration'], action['braking'], action['steering']
+        self.telemetry.record(self.write_time, wait_time, parse_time, self.observation_size, len(action_frame), elapsed_time, time_limit)
+
+        if action.get('protocol') in PROTOCOLS:
+            self.protocol = action['protocol']
+
+        if action.get('reusable'):
+            self.reusable = True
+
+        # 判断の間隔が含まれていれば、4番目の値として返します。
+        return (action['acceleration'], action['braking'], action['steering'], *((action['interval'],) if 'interval' in action else ()))
+
+    def get_action(self, observation):
+        self.send_observation(observation)
+
+        return self.receive_action()
+
+    def is_reusable(self):
+        # 時間切れになったプロセスは、アクションの送受信がずれている可能性があるので再利用しません。
+        return self.reusable and not self.time_over and self.process.poll() is None
+
+    def get_telemetry(self):
+        return {'name': self.name, 'protocol': self.protocol, 'time_over': self.time_over, **self.telemetry.summarize()}
+
+    def new_game(self):
+        # プロセスをそのまま使って、新しいゲームを始めます。プロトコルと制限時間、計測結果は、プロセスを起動した直後の状態に戻します。
+        write_new_game(self.process.stdin, self.protocol)
+
+        self.protocol = JSON
+        self.time_limits = concat((30 * 2,), repeat(0.5 * 2))
+        self.telemetry = Telemetry()
 
     def done(self):
         self.process.stdin.close()
@@ -43,3 +138,110 @@ class PlayerProxy:
         self.process.kill()
 
         self.stderr.close()
+
+
+class InProcessPlayer:
+    # 'try4.py:SteerAndAccelBrakeAvoid'のような名前で指定したクラスを、ゲームのプロセスに読み込んで実行します。パイプを使わないので、学習やチューニングで使用してください。
+    # 標準エラー出力の切り替えはスレッド・セーフではないので、Gameはこのプレイヤーを呼び出し元のスレッドでだけ実行します。
+    in_process = True
+
+    def __init__(self, program_name):
+        module_name, class_name = program_name.split(':')
+
+        self.program_name = program_name
+        self.name = module_name.replace('.py', '')
+
+        self.time_over = False
+        self.time_limits = concat((30 * 2,), repeat(0.5 * 2))
+
+        # パイプを使わないので、計測するのは応答の待ちの時間（get_actionの時間）だけです。
+        self.telemetry = Telemetry()
+
+        # プレイヤーの標準エラー出力は、PlayerProxyと同じログ・ファイルに出力します。
+        self.stderr = open(os.path.join('.', 'players', f'{self.name}-log.txt'), mode='a')
+
+        if os.path.join('.', 'players') not in sys.path:
+            sys.path.append(os.path.join('.', 'players'))
+
+        with redirect_stderr(self.stderr):
+            self.player = getattr(import_module(self.name), class_name)()
+
+    def send_observation(self, observation):
+        self.observation = observation
+
+    def receive_action(self):
+        if self.time_over:
+            return 0, 0, 0
+
+        starting_time = time()
+
+        with redirect_stderr(self.stderr):
+            action = tuple(self.player.get_action(self.observation))  # 判断の間隔を含めて、4つの値を返しても構いません。
+
+        elapsed_time = time() - starting_time
+        time_limit = first(self.time_limits)
+
+        if elapsed_time > time_limit:
+            self.time_over = True
+            self.stderr.write(f'*** time over. elapsed time: {elapsed_time} sec. ***\n')
+
+        self.time_limits = rest(self.time_limits)
+
+        self.telemetry.record(0, elapsed_time, 0, 0, 0, elapsed_time, time_limit)
+
+        return action
+
+    def get_action(self, observation):
+        self.send_observation(observation)
+
+        return self.receive_action()
+
+    def is_reusable(self):
+        return not self.time_over
+
+    def get_telemetry(self):
+        return {'name': self.name, 'protocol': None, 'time_over': self.time_over, **self.telemetry.summarize()}
+
+    def new_game(self):
+        if hasattr(self.player, 'new_game'):
+            with redirect_stderr(self.stderr):
+                self.player.new_game()
+
+        self.time_limits = concat((30 * 2,), repeat(0.5 * 2))
+        self.telemetry = Telemetry()
+
+    def done(self):
+        self.stderr.close()
+
+
+def create_player(program_name):
+    # クラス名が指定されている場合はプロセス内で、そうでなければ別プロセスで実行します。
+    return InProcessPlayer(program_name) if ':' in program_name else PlayerProxy(program_name)
+
+
+class PlayerPool:
+    # ゲームが終わったプレイヤーを保持して、次のゲームで再利用します。プロセスの起動やモジュールの読み込みの時間が、ゲーム毎にかからなくなります。
+    def __init__(self):
+        self.idle_players = defaultdict(list)
+
+    def create_player(self, program_name):
+        if self.idle_players[program_name]:
+            player = self.idle_players[program_name].pop()
+            player.new_game()
+
+            return player
+
+        return create_player(program_name)
+
+    def release(self, player):
+        # 再利用に対応していないプレイヤーや、時間切れになったプレイヤーは終了させます。
+        if player.is_reusable():
+            self.idle_players[player.program_name].append(player)
+        else:
+            player.done()
+
+    def close(self):
+        for player in cat(self.idle_players.values()):
+            player.done()
+
+        self.idle_players.clear()
@@ -0,0 +1,175 @@
+import json
+import struct
+import sys
+
+
+# 通信プロトコル。最初の観測は必ずJSONで送信されます。プレイヤーが最初のアクションに'protocol'を含めて返すと、以降はそのプロトコルで通信します。
+JSON = 'json'
+PACKED = 'packed'
+PACKED_WITH_INTERVAL = 'packed_with_interval'  # PACKEDのアクションに、判断の間隔を加えたものです。
+
+PROTOCOLS = (JSON, PACKED, PACKED_WITH_INTERVAL)
+
+_PACKED_PROTOCOLS = (PACKED, PACKED_WITH_INTERVAL)
+
+# PACKEDのフレーム。観測は、フレームの種類と他の車・障害物・スターの数のヘッダーの後に、値をdoubleで固定の順序で並べます。アクションはdouble3つです。PACKED_WITH_INTERVALのアクションはdouble4つです。
+OBSERVATION_FRAME = 0
+NEW_GAME_FRAME = 1
+
+# プロセスを再利用して新しいゲームを始める場合のメッセージです。read_observationはこの値を返します。新しいゲームの最初の観測は、またJSONで送信されます。
+# 最初のアクションに'reusable'を含めたプレイヤーにだけ送信します。
+NEW_GAME = 'new_game'
+
+_HEADER = struct.Struct('<BHHH')
+_ACTION = struct.Struct('<3d')
+_ACTION_WITH_INTERVAL = struct.Struct('<4d')
+
+_MY_CAR_KEYS = ('angle', 'velocity_angle', 'velocity_length', 'steering_angle', 'steering_torque', 'score', 'crash_energy')
+_OTHER_CAR_KEYS = ('position_angle', 'position_length', 'angle', 'velocity_angle', 'velocity_length', 'steering_angle', 'score', 'crash_energy')
+_OBSTACLE_OR_STAR_KEYS = ('position_angle', 'position_length')
+
+# アクションの4番目の値は判断の間隔で、次に観測を受け取るまで、そのアクションを何ステップ繰り返すかです。省略した場合は1で、ゲームのmax_decision_intervalを超える値は丸められます。
+_ACTION_KEYS = ('acceleration', 'braking', 'steering', 'interval')
+
+
+def _get_values(collection, keys):
+    for item in collection:
+        for key in keys:
+            yield item[key]
+
+
+def _create_dicts(values, keys, count):
+    return tuple(map(lambda i: dict(zip(keys, values[len(keys) * i: len(keys) * (i + 1)])), range(count)))
+
+
+def _restore_score(item):
+    # スコアは整数なので、doubleから戻しておきます。
+    item['score'] = int(item['score'])
+
+    return item
+
+
+def pack_observation(observation):
+    my_car = observation['my_car']
+    values = (*my_car['position'], *map(my_car.__getitem__, _MY_CAR_KEYS), *_get_values(observation['other_cars'], _OTHER_CAR_KEYS), *_get_values(observation['obstacles'], _OBSTACLE_OR_STAR_KEYS), *_get_values(observation['stars'], _OBSTACLE_OR_STAR_KEYS))
+
+    return _HEADER.pack(OBSERVATION_FRAME, len(observation['other_cars']), len(observation['obstacles']), len(observation['stars'])) + struct.pack(f'<{len(values)}d', *values)
+
+
+def _get_packed_observation_size(other_car_count, obstacle_count, star_count):
+    return 8 * (2 + len(_MY_CAR_KEYS) + len(_OTHER_CAR_KEYS) * other_car_count + len(_OBSTACLE_OR_STAR_KEYS) * (obstacle_count + star_count))
+
+
+def unpack_observation(other_car_count, obstacle_count, star_count, buffer):
+    values = struct.unpack(f'<{len(buffer) // 8}d', buffer)
+
+    my_car_values, values = values[:2 + len(_MY_CAR_KEYS)], values[2 + len(_MY_CAR_KEYS):]
+    other_car_values, values = values[:len(_OTHER_CAR_KEYS) * other_car_count], values[len(_OTHER_CAR_KEYS) * other_car_count:]
+    obstacle_values, star_values = values[:len(_OBSTACLE_OR_STAR_KEYS) * obstacle_count], values[len(_OBSTACLE_OR_STAR_KEYS) * obstacle_count:]
+
+    return {
+        'my_car': _restore_score({'position': list(my_car_values[:2]), **dict(zip(_MY_CAR_KEYS, my_car_values[2:]))}),
+        'other_cars': tuple(map(_restore_score, _create_dicts(other_car_values, _OTHER_CAR_KEYS, other_car_count))),
+        'obstacles': _create_dicts(obstacle_values, _OBSTACLE_OR_STAR_KEYS, obstacle_count),
+        'stars': _create_dicts(star_values, _OBSTACLE_OR_STAR_KEYS, star_count)
+    }
+
+
+def write_observation(stream, observation, protocol):
+    # 書き込んだバイト数を返します。
+    frame = pack_observation(observation) if protocol in _PACKED_PROTOCOLS else f'{json.dumps(observation)}\n'.encode()
+
+    stream.write(frame)
+    stream.flush()
+
+    return len(frame)
+
+
+def write_new_game(stream, protocol):
+    if protocol in _PACKED_PROTOCOLS:
+        stream.write(_HEADER.pack(NEW_GAME_FRAME, 0, 0, 0))
+    else:
+        stream.write(f'{json.dumps({NEW_GAME: True})}\n'.encode())
+
+    stream.flush()
+
+
+def read_observation(stream, protocol):
+    # 入力が終了した場合は、Noneを返します。新しいゲームの開始が通知された場合は、NEW_GAMEを返します。
+    if protocol in _PACKED_PROTOCOLS:
+        header = stream.read(_HEADER.size)
+
+        if len(header) < _HEADER.size:
+            return None
+
+        frame_type, other_car_count, obstacle_count, star_count = _HEADER.unpack(header)
+
+        if frame_type == NEW_GAME_FRAME:
+            return NEW_GAME
+
+        return unpack_observation(other_car_count, obstacle_count, star_count, stream.read(_get_packed_observation_size(other_car_count, obstacle_count, star_count)))
+
+    line = stream.readline()
+
+    if not line:
+        return None
+
+    message = json.loads(line)
+
+    return NEW_GAME if message.get(NEW_GAME) else message
+
+
+def write_action(stream, action, protocol, next_protocol=None, reusable=False):
+    if protocol == PACKED:
+        stream.write(_ACTION.pack(*action[:3]))
+    elif protocol == PACKED_WITH_INTERVAL:
+        stream.write(_ACTION_WITH_INTERVAL.pack(*action[:3], action[3] if len(action) > 3 else 1))
+    else:
+        stream.write(f'{json.dumps({**dict(zip(_ACTION_KEYS, action)), **({"protocol": next_protocol} if next_protocol else {}), **({"reusable": True} if reusable else {})})}\n'.encode())
+
+    stream.flush()
+
+
+def read_action_frame(stream, protocol):
+    if protocol == PACKED:
+        return stream.read(_ACTION.size)
+
+    if protocol == PACKED_WITH_INTERVAL:
+        return stream.read(_ACTION_WITH_INTERVAL.size)
+
+    return stream.readline()
+
+
+def parse_action_frame(frame, protocol):
+    if protocol == PACKED:
+        return dict(zip(_ACTION_KEYS, _ACTION.unpack(frame)))
+
+    if protocol == PACKED_WITH_INTERVAL:
+        return dict(zip(_ACTION_KEYS, _ACTION_WITH_INTERVAL.unpack(frame)))
+
+    return json.loads(frame)
+
+
+def read_action(stream, protocol):
+    return parse_action_frame(read_action_frame(stream, protocol), protocol)
+
+
+def run(player, protocol=PACKED):
+    # プレイヤーのメイン・ループ。最初のアクションでprotocolを要求して、以降はそのプロトコルで通信します。ゲームの後にプロセスを再利用できることも伝えます。
+    # player.get_actionが判断の間隔を含む4つの値を返す場合は、JSONかPACKED_WITH_INTERVALを使用してください。PACKEDでは、判断の間隔は送信されません。
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    current_protocol = JSON
+
+    while (observation := read_observation(stdin, current_protocol)) is not None:
+        # 新しいゲームが始まったら、プレイヤーにnew_gameがあれば呼び出して、最初の観測からやり直します。
+        if observation == NEW_GAME:
+            if hasattr(player, 'new_game'):
+                player.new_game()
+
+            current_protocol = JSON
+            continue
+
+        write_action(stdout, player.get_action(observation), current_protocol, protocol if current_protocol != protocol else None, current_protocol == JSON)
+        current_protocol = protocol
@@ -1,7 +1,7 @@
-import json
 import sys
 
 from operator import itemgetter
+from protocol import PACKED, run
 
 
 class Steer:
@@ -30,20 +30,8 @@ def main():
 
     print('started!', file=sys.stderr)
 
-    while True:
-        try:
-            observation = json.loads(input())
-
-            acceleration, breaking, steering = player.get_action(observation)
-
-            print(json.dumps({
-                'acceleration': acceleration,
-                'braking': breaking,
-                'steering': steering
-            }))
-
-        except EOFError:
-            break
+    # 観測の受信とアクションの送信はprotocolモジュールに任せます。通信量が少ないPACKEDプロトコルを使用します。
+    run(player, PACKED)
 
     print('finished!', file=sys.stderr)
 
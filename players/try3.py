@@ -1,8 +1,8 @@
-import json
 import sys
 
 from math import pi
 from operator import itemgetter
+from protocol import PACKED, run
 
 
 class SteerAndAccelBrake:
@@ -37,20 +37,7 @@ def main():
 
     print('started!', file=sys.stderr)
 
-    while True:
-        try:
-            observation = json.loads(input())
-
-            acceleration, breaking, steering = player.get_action(observation)
-
-            print(json.dumps({
-                'acceleration': acceleration,
-                'braking': breaking,
-                'steering': steering
-            }))
-
-        except EOFError:
-            break
+    run(player, PACKED)
 
     print('finished!', file=sys.stderr)
 
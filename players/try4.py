@@ -1,11 +1,11 @@
 import cv2
-import json
 import numpy as np
 import sys
 
 from funcy import concat
 from math import pi
 from operator import itemgetter
+from protocol import PACKED, run
 
 
 def normalize_angle(angle):
@@ -153,20 +153,7 @@ def main(visualize=False):
 
     print('started!', file=sys.stderr)
 
-    while True:
-        try:
-            observation = json.loads(input())
-
-            acceleration, breaking, steering = player.get_action(observation)
-
-            print(json.dumps({
-                'acceleration': acceleration,
-                'braking': breaking,
-                'steering': steering
-            }))
-
-        except EOFError:
-            break
+    run(player, PACKED)
 
     print('finished!', file=sys.stderr)
 
@@ -1,33 +1,15 @@
+from evaluation import get_order_intervals
 from funcy import second
+from results_store import ResultsStore
 
 
-def get_orders():
-    result = {}
+# 集計はゲームを記録する度に更新されているので、ゲームの数が増えても時間はかかりません。以前のorders.txtしかない場合は、results_store.pyでscores.txtを読み込んでください。
+results_store = ResultsStore('.\\results\\results.sqlite3')
 
-    with open('.\\results\\orders.txt') as f:
-        for line in f.readlines():
-            if len(line.split('\t')) != 2:
-                continue
+player_stats = results_store.get_player_stats()
+intervals = get_order_intervals(player_stats, map(lambda stats: stats[0], player_stats))  # 平均順位の95%信頼区間です。ゲームが少ないプレイヤーの区間は無限です。
 
-            name = line.split('\t')[0]
-            order = int(line.split('\t')[1])
+for name, average_order, win_rate, game_count, _, _ in sorted(player_stats, key=second):
+    print(f'{name}\t{average_order:.3f}\t{game_count}\t{win_rate:.3f}\t{intervals[name][0]:.3f}\t{intervals[name][1]:.3f}')
 
-            if name not in result:
-                result[name] = [order]
-            else:
-                result[name].append(order)
-
-    return result
-
-
-def get_averate_orders():
-    result = {}
-
-    for name, orders in get_orders().items():
-        result[name] = (sum(orders) / len(orders), len(orders))
-
-    return result
-
-
-for name, average_order in sorted(get_averate_orders().items(), key=second):
-    print(f'{name}\t{average_order[0]:.3f}\t{average_order[1]}')
+results_store.close()
@@ -0,0 +1,10 @@
+from results_store import ResultsStore
+
+
+# レーティングの高い順に、プレイヤー名とmu、sigma、控えめな実力の推定値（mu - 3 * sigma）を表示します。ゲームが少なくてsigmaが大きいプレイヤーは、控えめな推定値が低くなります。
+results_store = ResultsStore('.\\results\\results.sqlite3')
+
+for name, (mu, sigma) in sorted(results_store.get_ratings().items(), key=lambda name_and_rating: name_and_rating[1].mu - 3 * name_and_rating[1].sigma, reverse=True):
+    print(f'{name}\t{mu:.3f}\t{sigma:.3f}\t{mu - 3 * sigma:.3f}')
+
+results_store.close()
@@ -0,0 +1,58 @@
+import json
+import numpy as np
+
+from collections import Counter
+from time import perf_counter
+
+
+# Game.stepの処理の段階です。観測の作成、プレイヤーとの通信、アクションの正規化と実行、物理シミュレーション、スターの再配置、リプレイの記録の順に実行されます。
+PHASES = ('observation', 'players', 'actions', 'space_step', 'star_reset', 'replay')
+
+
+class StepProfiler:
+    # Game.stepの時間を段階毎に計測します。Gameにprofilerを渡した場合だけ、Gameが計測のメソッドを呼び出します。
+    def __init__(self):
+        self.step_timings = []
+        self.counts = Counter()
+
+    def start_step(self):
+        self.timings = [0.0] * len(PHASES)
+        self.step_timings.append(self.timings)
+
+        self.lap_time = perf_counter()
+
+    def lap(self, phase):
+        # 前回の計測からの時間を、phaseの時間に加えます。
+        now = perf_counter()
+
+        self.timings[PHASES.index(phase)] += now - self.lap_time
+        self.lap_time = now
+
+    def count(self, name):
+        self.counts[name] += 1
+
+    def report(self):
+        timings = np.array(self.step_timings, dtype=np.float64).reshape(-1, len(PHASES))
+        total = float(timings.sum())
+
+        def summarize(phase_timings):
+            return {
+                'total': float(phase_timings.sum()),
+                'share': float(phase_timings.sum()) / total if total else None,
+                'mean': float(phase_timings.mean()),
+                'p50': float(np.percentile(phase_timings, 50)),
+                'p95': float(np.percentile(phase_timings, 95)),
+                'max': float(phase_timings.max())
+            } if len(phase_timings) else None
+
+        return {
+            'steps': len(timings),
+            'total': total,
+            'phases': dict(zip(PHASES, map(summarize, timings.T))),
+            'step': summarize(timings.sum(axis=1)),
+            'counts': dict(self.counts)
+        }
+
+    def write_report(self, path):
+        with open(path, mode='w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,61 @@
+from collections import namedtuple
+from heapq import nlargest
+from math import exp, sqrt
+
+
+# プレイヤーの実力の推定値です。muが平均、sigmaが標準偏差で、ゲームをする度にsigmaが小さくなります。
+Rating = namedtuple('Rating', ('mu', 'sigma'))
+
+MU = 25
+SIGMA = MU / 3
+BETA = SIGMA / 2  # 同じ実力のプレイヤーでも、ゲーム毎にこの程度は成績がばらつきます。
+KAPPA = 0.0001  # sigmaが0にならないようにするための下限です。
+
+DEFAULT_RATING = Rating(MU, SIGMA)
+
+
+def _get_win_probability(rating_1, rating_2):
+    # rating_1のプレイヤーが、rating_2のプレイヤーより上位になる確率と、2人の実力の差の尺度を返します。
+    c = sqrt(rating_1.sigma ** 2 + rating_2.sigma ** 2 + 2 * BETA ** 2)
+
+    return 1 / (1 + exp((rating_2.mu - rating_1.mu) / c)), c
+
+
+def update_ratings(ratings, orders):
+    # 1つのゲームの順位から、参加したプレイヤーのレーティングを更新します。WengとLinのBradley-Terryモデルを使用して、全てのプレイヤーの組を1対1の対戦とみなします。
+    # ratingsとordersは、ゲームに参加したプレイヤーの順に並べてください。更新したレーティングを同じ順で返します。
+    def update(i):
+        omega = 0
+        delta = 0
+
+        for q in range(len(ratings)):
+            if q == i:
+                continue
+
+            p, c = _get_win_probability(ratings[i], ratings[q])
+            s = 1 if orders[i] < orders[q] else 0.5 if orders[i] == orders[q] else 0
+
+            omega += ratings[i].sigma ** 2 / c * (s - p)
+            delta += ratings[i].sigma / c * ratings[i].sigma ** 2 / c ** 2 * p * (1 - p)
+
+        return Rating(ratings[i].mu + omega, ratings[i].sigma * sqrt(max(1 - delta, KAPPA)))
+
+    return tuple(map(update, range(len(ratings))))
+
+
+def get_information_gain(rating_1, rating_2):
+    # 2人が対戦した場合に期待できる、2人の実力の分散の減少の合計です。実力が近くて、実力が不確かなプレイヤー同士ほど大きくなります。
+    p, c = _get_win_probability(rating_1, rating_2)
+
+    return (rating_1.sigma ** 5 + rating_2.sigma ** 5) / c ** 3 * p * (1 - p)
+
+
+def choose_players(random, player_ratings, count):
+    # 次のゲームのプレイヤーを、プレイヤー名からレーティングへの辞書から選びます。
+    # 実力が不確かなプレイヤーほど選ばれやすいように1人目を選んで、その1人目との対戦で得られる情報が大きいプレイヤーを残りの車に選びます。計算量はプレイヤーの数に比例します。
+    names = random.sample(tuple(player_ratings.keys()), len(player_ratings))  # 情報の大きさが同じプレイヤーは、ランダムに選ばれるようにします。
+    anchor_name = random.choices(names, weights=tuple(map(lambda name: player_ratings[name].sigma ** 2, names)))[0]
+
+    names = [anchor_name, *nlargest(count - 1, filter(lambda name: name != anchor_name, names), key=lambda name: get_information_gain(player_ratings[anchor_name], player_ratings[name]))]
+
+    return random.sample(names, len(names))  # スタート位置が偏らないように、並べ替えます。
@@ -0,0 +1,168 @@
+import json
+import numpy as np
+import os
+import struct
+
+from funcy import concat, mapcat
+from game import Game, GameConfig
+from operator import attrgetter
+
+
+# リプレイ・ファイルは、マジック・ナンバーとJSONのヘッダーの後に、ステップ毎の固定長のレコードを並べたものです。レコードは固定長なので、np.memmapでそのまま読み込めます。
+MAGIC = b'SDRP'
+VERSION = 1
+
+_PREFIX = struct.Struct('<4sHI')
+
+
+def _get_record_dtype(car_count, obstacle_count, star_count):
+    return np.dtype([
+        ('bodies', '<f8', (car_count * 5 + obstacle_count + star_count, 3)),  # 車とタイヤ4つ、障害物、スターの順に、x座標とy座標と角度。
+        ('actions', '<f8', (car_count, 3)),
+        ('scores', '<i4', (car_count,)),
+        ('crash_energies', '<f8', (car_count,))
+    ])
+
+
+def _get_bodies(cars, obstacles, stars):
+    return concat(mapcat(lambda car: (car, car.tire_lf, car.tire_rf, car.tire_lr, car.tire_rr), cars), obstacles, stars)
+
+
+class ReplayWriter:
+    def __init__(self, path, chunk_size=300):
+        self.file = open(path, mode='wb')
+
+        # レコードはchunk_size件ずつまとめて書き込みます。
+        self.chunk_size = chunk_size
+        self.chunk = None
+        self.chunk_length = 0
+
+    def _write_header(self, game):
+        header = json.dumps({
+            'names': tuple(map(attrgetter('name'), game.players)),
+            'car_count': len(game.cars),
+            'obstacle_count': len(game.obstacles),
+            'star_count': len(game.stars),
+            'arena_size': game.config.arena_size
+        }).encode()
+
+        # レコードの開始位置を8バイト境界に揃えます。
+        header += b' ' * (-(_PREFIX.size + len(header)) % 8)
+
+        self.file.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+        self.file.write(header)
+
+    def _flush(self):
+        self.file.write(self.chunk[:self.chunk_length].tobytes())
+        self.chunk_length = 0
+
+    def write(self, game):
+        if self.chunk is None:
+            self._write_header(game)
+            self.chunk = np.zeros(self.chunk_size, dtype=_get_record_dtype(len(game.cars), len(game.obstacles), len(game.stars)))
+
+        record = self.chunk[self.chunk_length]
+
+        record['bodies'] = tuple(map(lambda body: (*body.position, body.angle), _get_bodies(game.cars, game.obstacles, game.stars)))
+        record['actions'] = game.actions
+        record['scores'] = tuple(map(attrgetter('score'), game.cars))
+        record['crash_energies'] = tuple(map(attrgetter('crash_energy'), game.cars))
+
+        self.chunk_length += 1
+
+        if self.chunk_length == self.chunk_size:
+            self._flush()
+
+    def close(self):
+        if self.chunk is not None:
+            self._flush()
+
+        self.file.close()
+
+
+class ReplayReader:
+    def __init__(self, path):
+        with open(path, mode='rb') as f:
+            prefix = f.read(_PREFIX.size)
+
+            # ステップを1つも実行せずに閉じたReplayWriterのファイルは、空になります。
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(f'{path} is empty or truncated, and has no replay header')
+
+            magic, version, header_size = _PREFIX.unpack(prefix)
+
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a replay file')
+
+            header = json.loads(f.read(header_size))
+
+        self.names = header['names']
+        self.car_count = header['car_count']
+        self.obstacle_count = header['obstacle_count']
+        self.star_count = header['star_count']
+        self.arena_size = header['arena_size']
+
+        dtype = _get_record_dtype(self.car_count, self.obstacle_count, self.star_count)
+        offset = _PREFIX.size + header_size
+        length = (os.path.getsize(path) - offset) // dtype.itemsize
+
+        self.records = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(length,)) if length else np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+
+class _ReplayPlayer:
+    def __init__(self, name):
+        self.name = name
+
+
+def _restore(game, record):
+    for body, (x, y, angle) in zip(_get_bodies(game.cars, game.obstacles, game.stars), record['bodies']):
+        # 重心が原点にない物体（車）は角度を設定すると位置が変わってしまうので、角度、位置の順に設定します。
+        body.angle = float(angle)
+        body.position = float(x), float(y)
+
+        game.space.reindex_shapes_for_body(body)
+
+    for car, score, crash_energy in zip(game.cars, record['scores'], record['crash_energies']):
+        car.score = int(score)
+        car.crash_energy = float(crash_energy)
+
+    game.actions = tuple(map(tuple, record['actions'].tolist()))
+
+
+def render(replay_reader, animation_writer, start=0, stop=None):
+    # 描画にはGameとui.create_surfaceをそのまま使用します。物体の位置はレコードで上書きするので、シードは何でも構いません。
+    game = Game(tuple(map(_ReplayPlayer, replay_reader.names)), config=GameConfig(replay_reader.car_count, replay_reader.obstacle_count, replay_reader.star_count, replay_reader.arena_size))
+
+    for record in replay_reader[start:stop]:
+        _restore(game, record)
+        animation_writer.write(game.create_surface())
+
+
+if __name__ == '__main__':
+    import pygame
+    import pymunk.pygame_util
+
+    from animation_writer import AnimationWriter
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('replay_path', metavar='REPLAY-PATH', help='replay file')
+    parser.add_argument('--start', type=int, default=0, help='first step to render')
+    parser.add_argument('--stop', type=int, help='step to stop rendering at')
+    parser.add_argument('--output', default='game.mp4', help='output mp4 file')
+
+    args = parser.parse_args()
+
+    # 画面は使わないので、フォントだけを初期化します。
+    pygame.font.init()
+    pymunk.pygame_util.positive_y_is_up = True
+
+    animation_writer = AnimationWriter(args.output)
+    render(ReplayReader(args.replay_path), animation_writer, start=args.start, stop=args.stop)
+    animation_writer.close()
@@ -0,0 +1,160 @@
+import sqlite3
+
+from funcy import first, last, second
+from rating import DEFAULT_RATING, Rating, update_ratings
+
+
+# ゲームの結果を保存するSQLiteのデータベースです。プレイヤー毎の集計はゲームを追加する度に更新するので、リーグが長くなっても集計結果はすぐに取得できます。
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS games (
+        game_id INTEGER PRIMARY KEY,
+        game_name TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS results (
+        game_id INTEGER NOT NULL REFERENCES games (game_id),
+        player_name TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        player_order INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS results_player_name ON results (player_name);
+
+    CREATE TABLE IF NOT EXISTS player_stats (
+        player_name TEXT PRIMARY KEY,
+        game_count INTEGER NOT NULL,
+        order_sum INTEGER NOT NULL,
+        win_count INTEGER NOT NULL,
+        score_sum INTEGER NOT NULL,
+        order_square_sum INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS ratings (
+        player_name TEXT PRIMARY KEY,
+        mu REAL NOT NULL,
+        sigma REAL NOT NULL
+    );
+'''
+
+
+def get_orders(names, scores):
+    # スコアの高い順に順位をつけます。同じスコアのプレイヤーは同じ順位です。
+    last_score = -1
+    order = 0
+
+    for i, (name, score) in enumerate(sorted(zip(names, scores), key=second, reverse=True)):
+        if score != last_score:
+            order = i + 1
+            last_score = score
+
+        yield name, score, order
+
+
+class ResultsStore:
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+
+        self.connection.executescript(_SCHEMA)
+
+    def add_game(self, game_name, names, scores):
+        # ゲームの結果と、プレイヤー毎の集計の更新は、同じトランザクションで実施します。
+        with self.connection:
+            game_id = self.connection.execute('INSERT INTO games (game_name) VALUES (?)', (game_name,)).lastrowid
+
+            ordered_results = tuple(get_orders(names, scores))
+
+            for name, score, order in ordered_results:
+                self.connection.execute('INSERT INTO results (game_id, player_name, score, player_order) VALUES (?, ?, ?, ?)', (game_id, name, score, order))
+                self.connection.execute('''
+                    INSERT INTO player_stats (player_name, game_count, order_sum, win_count, score_sum, order_square_sum) VALUES (?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (player_name) DO UPDATE SET
+                        game_count = game_count + 1,
+                        order_sum = order_sum + excluded.order_sum,
+                        win_count = win_count + excluded.win_count,
+                        score_sum = score_sum + excluded.score_sum,
+                        order_square_sum = order_square_sum + excluded.order_square_sum
+                ''', (name, order, int(order == 1), score, order * order))
+
+            # レーティングも、ゲーム毎に順位から更新します。
+            ordered_names = tuple(map(first, ordered_results))
+            self._set_ratings(dict(zip(ordered_names, update_ratings(tuple(self.get_ratings(ordered_names).values()), tuple(map(last, ordered_results))))))
+
+    def _set_ratings(self, player_ratings):
+        self.connection.executemany('INSERT OR REPLACE INTO ratings (player_name, mu, sigma) VALUES (?, ?, ?)', map(lambda name_and_rating: (name_and_rating[0], *name_and_rating[1]), player_ratings.items()))
+
+    def has_game(self, game_name):
+        return self.connection.execute('SELECT 1 FROM games WHERE game_name = ?', (game_name,)).fetchone() is not None
+
+    def get_player_stats(self):
+        # プレイヤー名と、平均順位、勝率、ゲーム数、平均スコア、順位の不偏分散を返します。ゲーム数が1の場合、分散はNoneです。
+        return self.connection.execute('''
+            SELECT
+                player_name,
+                CAST(order_sum AS REAL) / game_count,
+                CAST(win_count AS REAL) / game_count,
+                game_count,
+                CAST(score_sum AS REAL) / game_count,
+                CASE WHEN game_count > 1 THEN (order_square_sum - CAST(order_sum AS REAL) * order_sum / game_count) / (game_count - 1) END
+            FROM player_stats
+        ''').fetchall()
+
+    def get_ratings(self, player_names=None):
+        # プレイヤー名からレーティングへの辞書を返します。player_namesを指定した場合はその順で、まだゲームをしていないプレイヤーのレーティングはDEFAULT_RATINGです。
+        if player_names is None:
+            return dict(map(lambda row: (row[0], Rating(*row[1:])), self.connection.execute('SELECT player_name, mu, sigma FROM ratings')))
+
+        player_names = tuple(player_names)
+        ratings = dict(map(lambda row: (row[0], Rating(*row[1:])), self.connection.execute(f'SELECT player_name, mu, sigma FROM ratings WHERE player_name IN ({", ".join("?" * len(player_names))})', player_names)))
+
+        return {name: ratings.get(name, DEFAULT_RATING) for name in player_names}
+
+    def get_player_results(self, player_name):
+        # プレイヤーの全てのゲームの、ゲーム名とスコアと順位を返します。
+        return self.connection.execute('SELECT game_name, score, player_order FROM results JOIN games USING (game_id) WHERE player_name = ? ORDER BY game_id', (player_name,)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def _read_scores(path):
+    # scores.txtを、ゲーム名とプレイヤー名のリストとスコアのリストの組に変換します。
+    with open(path) as f:
+        game_name, names, scores = None, [], []
+
+        for line in map(str.rstrip, f):
+            if not line:
+                if game_name:
+                    yield game_name, names, scores
+
+                game_name, names, scores = None, [], []
+
+            elif game_name is None:
+                game_name = line
+
+            else:
+                name, score = line.split('\t')
+
+                names.append(name)
+                scores.append(int(score))
+
+        if game_name:
+            yield game_name, names, scores
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('scores_path', metavar='SCORES-PATH', help='scores.txt to import into the results database')
+    parser.add_argument('--database', default='.\\results\\results.sqlite3', help='results database')
+
+    args = parser.parse_args()
+
+    results_store = ResultsStore(args.database)
+
+    # 登録済みのゲームは飛ばすので、何度実行しても構いません。
+    for game_name, names, scores in _read_scores(args.scores_path):
+        if not results_store.has_game(game_name):
+            results_store.add_game(game_name, names, scores)
+
+    results_store.close()
@@ -1,45 +1,134 @@
+import json
 import os
-import shutil
 
-from funcy import first, last, second
-from glob import glob
-from random import sample
-from subprocess import PIPE, run
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from evaluation import get_order_intervals, get_unsettled_player_names, sample_players
+from funcy import count, first, last
+from game import GameConfig, add_game_config_arguments, get_game_config, play_headless
+from glob import glob
+from multiprocessing.util import Finalize
+from player_proxy import PlayerPool
+from profiler import StepProfiler
+from random import Random
+from rating import choose_players
+from replay import ReplayWriter
+from results_store import ResultsStore, get_orders
+
+
+# ワーカー・プロセス毎のプレイヤーのプールです。プールのプレイヤーのプロセスは、ワーカー・プロセスの終了時に終了させます。
+_player_pool = PlayerPool()
+
+
+def _initialize_worker():
+    # multiprocessingのプロセスの終了時には、atexitではなくFinalizeの処理が実行されます。
+    Finalize(_player_pool, _player_pool.close, exitpriority=0)
+
+
+def play_game(player_names, seed, concurrent_players=False, replay_path=None, config=GameConfig(), reuse_players=False, profile_path=None):
+    # ワーカー・プロセスの中で、プレイヤーのプロセス群を起動してゲームを実行します。reuse_playersの場合は、前のゲームのプレイヤーのプロセスを再利用します。
+    replay_writer = ReplayWriter(replay_path) if replay_path else None
+    profiler = StepProfiler() if profile_path else None
+
+    try:
+        names, scores, telemetries = play_headless(player_names, seed, concurrent_players=concurrent_players, replay_writer=replay_writer, config=config, player_pool=_player_pool if reuse_players else None, profiler=profiler)
+
+    finally:
+        # ゲームが例外で終了した場合も、それまでのリプレイを書き出します。
+        if replay_writer:
+            replay_writer.close()
+
+    if profiler:
+        profiler.write_report(profile_path)
 
+    return tuple(names), tuple(scores), telemetries
 
-def main():
+
+def write_results(results_store, game_name, names, scores, telemetries):
+    # 結果の書き込みはメイン・プロセスだけが実施するので、ファイルの内容が混ざることはありません。集計にはresults_storeを使用してください。テキスト・ファイルは、人が読むためのものです。
+    results_store.add_game(game_name, names, scores)
+
+    with open('.\\results\\scores.txt', mode='a') as f:
+        print(game_name, file=f)
+        for name, score in zip(names, scores):
+            print(f'{name}\t{score}', file=f)
+        print(file=f)
+
+    with open('.\\results\\orders.txt', mode='a') as f:
+        print(game_name, file=f)
+        for player_name, _, order in get_orders(names, scores):
+            print(f'{player_name}\t{order}', file=f)
+        print(file=f)
+
+    # プレイヤー毎の応答時間と通信量は、1ゲーム1行のJSONで記録します。
+    with open('.\\results\\telemetry.jsonl', mode='a') as f:
+        print(json.dumps({'game_name': game_name, 'players': telemetries}), file=f)
+
+
+def main(worker_count, seed=None, hours=72, concurrent_players=False, need_replays=False, config=GameConfig(), reuse_players=False, need_profiles=False, precision=None, confidence=0.95, minimum_game_count=10, rating_matchmaking=False):
     starting_datetime = datetime.now()
     player_names = tuple(sorted(map(lambda bat_file_path: first(last(bat_file_path.split(os.path.sep)).split('.')), glob('.\\players\\*.bat'))))
 
-    while ((now := datetime.now()) - starting_datetime).total_seconds() < 72 * 60 * 60:
-        game_name = f'{now.year:04}-{now.month:02}-{now.day:02}-{now.hour:02}-{now.minute:02}-{now.second:02}'
+    # プレイヤーの選択とゲームのシードは、このRandomだけから生成します。なので、シードを指定すれば対戦の組み合わせを再現できます。
+    tournament_random = Random(seed)
+    game_player_count = min(config.car_count, len(player_names))  # プレイヤーより車が多い場合、残りの車はプレイヤーなしで走ります。
+    game_names = map(lambda i: f'{starting_datetime.year:04}-{starting_datetime.month:02}-{starting_datetime.day:02}-{starting_datetime.hour:02}-{starting_datetime.minute:02}-{starting_datetime.second:02}-{i:06}', count())
 
-        run_result = run(f'python game.py --animation {" ".join(sample(player_names, 8))}', shell=True, stdout=PIPE, universal_newlines=True)
+    results_store = ResultsStore('.\\results\\results.sqlite3')
 
-        shutil.move('game.mp4', f'.\\results\\{game_name}.mp4')
+    with ProcessPoolExecutor(worker_count, initializer=_initialize_worker) as executor:
+        futures = deque()
 
-        with open('.\\results\\scores.txt', mode='a') as f:
-            print(game_name, file=f)
-            for result in run_result.stdout.splitlines()[2:]:
-                print(result, file=f)
-            print(file=f)
+        while True:
+            # ワーカーの数だけゲームを並行して実行します。
+            while len(futures) < worker_count and (datetime.now() - starting_datetime).total_seconds() < hours * 60 * 60:
+                # precisionを指定した場合は、平均順位の信頼区間が重なっているプレイヤーを優先して対戦させて、全てのプレイヤーの順位が定まったらゲームの投入をやめます。
+                # 信頼区間には、以前に記録したゲームの結果も含めます。
+                if precision is not None:
+                    unsettled_player_names = get_unsettled_player_names(get_order_intervals(results_store.get_player_stats(), player_names, confidence, minimum_game_count), precision)
 
-        with open('.\\results\\orders.txt', mode='a') as f:
-            last_score = -1
-            order = 0
+                    if not unsettled_player_names:
+                        break
 
-            print(game_name, file=f)
-            for i, (player_name, player_score) in enumerate(sorted(map(lambda result: (result.split('\t')[0], int(result.split('\t')[1])), run_result.stdout.splitlines()[2:]), key=second, reverse=True)):
-                if player_score != last_score:
-                    order = i + 1
-                    last_score = player_score
+                # rating_matchmakingの場合は、レーティングから情報が多く得られる組み合わせを選びます。
+                if rating_matchmaking:
+                    game_player_names = choose_players(tournament_random, results_store.get_ratings(player_names), game_player_count)
+                elif precision is not None:
+                    game_player_names = sample_players(tournament_random, player_names, unsettled_player_names, game_player_count)
+                else:
+                    game_player_names = tournament_random.sample(player_names, game_player_count)
 
-                print(f'{player_name}\t{order}', file=f)
-            print(file=f)
+                game_name = next(game_names)
+                futures.append((game_name, executor.submit(play_game, game_player_names, tournament_random.randrange(2 ** 32), concurrent_players, f'.\\results\\{game_name}.replay' if need_replays else None, config, reuse_players, f'.\\results\\{game_name}.profile.json' if need_profiles else None)))
 
-        # run('taskkill /im TestDrive.exe /f /t')
+            if not futures:
+                break
+
+            # 投入した順に結果を記録するので、ゲーム名の順序と結果ファイルの順序は一致します。
+            game_name, future = futures.popleft()
+            write_results(results_store, game_name, *future.result())
+
+    results_store.close()
 
 
 if __name__ == '__main__':
-    main()
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of games played at once')
+    parser.add_argument('--seed', type=int, help='random seed of the tournament')
+    parser.add_argument('--hours', type=float, default=72, help='tournament period')
+    parser.add_argument('--concurrent-players', action='store_true', help='wait for all players\' actions concurrently')
+    parser.add_argument('--replay', action='store_true', help='record replays to render with replay.py')
+    parser.add_argument('--reuse-players', action='store_true', help='keep player processes running and reuse them in later games')
+    parser.add_argument('--profile', action='store_true', help='record the time spent in each phase of the steps')
+    parser.add_argument('--precision', type=float, help='focus on the players whose average order is not settled, and stop when every confidence interval is within this half width or apart from the others')
+    parser.add_argument('--confidence', type=float, default=0.95, help='confidence level of the intervals of the average orders')
+    parser.add_argument('--minimum-games', type=int, default=10, help='number of games before trusting a player\'s confidence interval')
+    parser.add_argument('--rating-matchmaking', action='store_true', help='choose the lineups that tell the most about the players\' skill ratings instead of random ones')
+    add_game_config_arguments(parser)
+
+    args = parser.parse_args()
+
+    main(args.workers, seed=args.seed, hours=args.hours, concurrent_players=args.concurrent_players, need_replays=args.replay, config=get_game_config(args), reuse_players=args.reuse_players, need_profiles=args.profile, precision=args.precision, confidence=args.confidence, minimum_game_count=args.minimum_games, rating_matchmaking=args.rating_matchmaking)
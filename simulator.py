@@ -1,7 +1,10 @@
+import numpy as np
 import pymunk
 import pymunk.pygame_util
 
-from math import pi
+from funcy import last
+from math import cos, pi, sin, sqrt
+from operator import attrgetter
 
 
 MAX_SPEED = 300
@@ -18,10 +21,13 @@ class Body(pymunk.Body):
 
 
 class Tire(Body):
-    def __init__(self, space, car, grip):
+    def __init__(self, space, car, grip, batched_dynamics=False):
         super().__init__()
 
-        self.velocity_func = self._update_velocity
+        # batched_dynamicsの場合は、BatchedDynamicsが全てのタイヤをまとめて計算します。
+        if not batched_dynamics:
+            self.velocity_func = self._update_velocity
+
         self.car = car
         self.grip = grip
 
@@ -78,7 +84,7 @@ class Tire(Body):
 
 
 class Car(Body):
-    def __init__(self, space):
+    def __init__(self, space, batched_dynamics=False):
         super().__init__()
 
         shape = pymunk.Poly(self, ((-20, 7.5), (-5, 10), (20, 5), (20, -5), (-5, -10), (-20, -7.5)))
@@ -86,10 +92,10 @@ class Car(Body):
         shape.density = 0.01  # タイヤ側の動作しか計算していないので、車両側は軽くして影響を減らしました……。
         shape.elasticity = 0.2
 
-        self.tire_lf = Tire(space, self, 500)
-        self.tire_rf = Tire(space, self, 500)
-        self.tire_lr = Tire(space, self, 300)  # ドリフトするように、リア・タイヤのグリップを落としました。
-        self.tire_rr = Tire(space, self, 300)
+        self.tire_lf = Tire(space, self, 500, batched_dynamics)
+        self.tire_rf = Tire(space, self, 500, batched_dynamics)
+        self.tire_lr = Tire(space, self, 300, batched_dynamics)  # ドリフトするように、リア・タイヤのグリップを落としました。
+        self.tire_rr = Tire(space, self, 300, batched_dynamics)
 
         self.tire_lf.position = ( 12.5,  12.5)  # noqa: E201, E241
         self.tire_rf.position = ( 12.5, -12.5)  # noqa: E201
@@ -106,7 +112,13 @@ class Car(Body):
         rotation_tire_lr = pymunk.RotaryLimitJoint(self, self.tire_lr, 0, 0)
         rotation_tire_rr = pymunk.RotaryLimitJoint(self, self.tire_rr, 0, 0)
 
-        space.add(self, shape, pyvot_tire_lf, pyvot_tire_rf, pyvot_tire_lr, pyvot_tire_rr, rotation_tire_lf, rotation_tire_rf, rotation_tire_lr, rotation_tire_rr)
+        self.joints = (pyvot_tire_lf, pyvot_tire_rf, pyvot_tire_lr, pyvot_tire_rr, rotation_tire_lf, rotation_tire_rf, rotation_tire_lr, rotation_tire_rr)
+
+        space.add(self, shape, *self.joints)
+
+    def create_joints(self):
+        # ジョイントを、同じパラメーターの新しいジョイントに置き換えます。古いジョイントを空間から取り除いてから呼び出して、新しいジョイントを空間に追加してください。
+        self.joints = tuple(map(lambda joint: pymunk.PivotJoint(joint.a, joint.b, joint.anchor_a, joint.anchor_b) if isinstance(joint, pymunk.PivotJoint) else pymunk.RotaryLimitJoint(joint.a, joint.b, joint.min, joint.max), self.joints))
 
     def set_position_and_angle(self, position, angle):
         super().set_position_and_angle(position, angle)
@@ -132,10 +144,11 @@ class Car(Body):
 
 
 class Star(Body):
-    def __init__(self, space):
+    def __init__(self, space, batched_dynamics=False):
         super().__init__()
 
-        self.velocity_func = self._update_velocity
+        if not batched_dynamics:
+            self.velocity_func = self._update_velocity
 
         outers = tuple(map(lambda i: pymunk.Vec2d(20, 0).rotated(                 pi * 2 / 5 * i), range(5)))  # noqa: E201
         inners = tuple(map(lambda i: pymunk.Vec2d(10, 0).rotated(pi * 2 / 5 / 2 + pi * 2 / 5 * i), range(5)))
@@ -163,10 +176,11 @@ class Star(Body):
 
 
 class Obstacle(Body):
-    def __init__(self, space):
+    def __init__(self, space, batched_dynamics=False):
         super().__init__()
 
-        self.velocity_func = self._update_velocity
+        if not batched_dynamics:
+            self.velocity_func = self._update_velocity
 
         shape = pymunk.Circle(self, 10)
         shape.density = 2
@@ -181,6 +195,98 @@ class Obstacle(Body):
         self.torque += -1 * self.moment * self.angular_velocity * 0.5
 
 
+class BatchedDynamics:
+    # Tire、Star、Obstacleの_update_velocityと同じ計算を、全ての物体についてnumpyでまとめて実施します。物体はbatched_dynamicsで作成して、velocity_funcを設定しないでください。
+    # 速度の積分はchipmunkの標準の関数で実施して、最後に積分される物体のvelocity_funcでまとめて計算します。なので、全ての物体をSpaceに追加してから作成してください。
+    # chipmunkは物体を取り除くと積分の順序を入れ替えるので、作成した後は物体を取り除かないでください。物体を追加する場合も、作り直す必要があります。
+    # 計算の順序と方法は_update_velocityと同じにしてあるので、結果は完全に同じになります。
+    def __init__(self, space):
+        dynamic_bodies = tuple(filter(lambda body: body.body_type == pymunk.Body.DYNAMIC, space.bodies))
+
+        self.tires = tuple(filter(lambda body: isinstance(body, Tire), dynamic_bodies))
+        self.damped_bodies = tuple(filter(lambda body: isinstance(body, (Star, Obstacle)), dynamic_bodies))
+
+        self.tire_masses = np.array(tuple(map(attrgetter('mass'), self.tires)), dtype=np.float64)
+        self.tire_moments = np.array(tuple(map(attrgetter('moment'), self.tires)), dtype=np.float64)
+        self.tire_grips = np.array(tuple(map(attrgetter('grip'), self.tires)), dtype=np.float64)
+        self.damped_body_masses = np.array(tuple(map(attrgetter('mass'), self.damped_bodies)), dtype=np.float64)
+        self.damped_body_moments = np.array(tuple(map(attrgetter('moment'), self.damped_bodies)), dtype=np.float64)
+
+        # chipmunkは物体を追加した順に速度を積分するので、最後に追加した物体の積分の後なら、全ての物体の速度が積分済みです。動的な物体がなければ、計算するものはありません。
+        self.last_body = last(dynamic_bodies)
+
+        if dynamic_bodies:
+            self.last_body.velocity_func = self._update_velocity
+
+    def is_last_body(self, space):
+        # velocity_funcを設定した物体が、まだ最後に積分される物体かを返します。
+        return last(filter(lambda body: body.body_type == pymunk.Body.DYNAMIC, space.bodies)) is self.last_body
+
+    def _update_tires(self, dt):
+        if not self.tires:
+            return
+
+        velocities = np.array(tuple(map(attrgetter('velocity'), self.tires)), dtype=np.float64)
+        angles = tuple(map(attrgetter('angle'), self.tires))
+        angular_velocities = np.array(tuple(map(attrgetter('angular_velocity'), self.tires)), dtype=np.float64)
+
+        # chipmunkと同じ値になるように、三角関数はmathで計算します。
+        coses = np.array(tuple(map(cos, angles)), dtype=np.float64)
+        sins = np.array(tuple(map(sin, angles)), dtype=np.float64)
+
+        # タイヤの座標系での速度です。
+        surges = velocities[:, 0] * coses - velocities[:, 1] * -sins
+        sways = velocities[:, 0] * -sins + velocities[:, 1] * coses
+
+        # 前後方向の抵抗は、次のステップの力になります。
+        surge_forces = -np.sign(surges) * (self.tire_masses * 5)
+        forces = np.stack((coses * surge_forces, sins * surge_forces), axis=-1) + 0.0
+
+        # 横方向のグリップは、撃力として速度に加えます。
+        sway_impulses = -self.tire_masses * sways
+        sway_impulse_lengths = np.abs(sway_impulses)
+        slips = sway_impulse_lengths > self.tire_grips
+        sway_impulses[slips] *= self.tire_grips[slips] / sway_impulse_lengths[slips]
+
+        velocities += np.stack((-sins * sway_impulses, coses * sway_impulses), axis=-1) * (1 / self.tire_masses)[:, np.newaxis]
+
+        torques = 0.0 - self.tire_moments * angular_velocities * (1 / dt) * 0.1
+
+        # 速度の制限は、pymunk.Vec2d.lengthとnumpyで長さの丸め誤差が異なるので、制限に近いタイヤだけVec2d.lengthと同じ方法で計算します。
+        for i in np.flatnonzero(np.sqrt(np.sum(velocities * velocities, axis=-1)) > MAX_SPEED * 0.999999):
+            velocity_x, velocity_y = velocities[i].tolist()
+            velocity_length = sqrt(velocity_x ** 2 + velocity_y ** 2)
+
+            if velocity_length > MAX_SPEED:
+                velocities[i] = velocity_x * (MAX_SPEED / velocity_length), velocity_y * (MAX_SPEED / velocity_length)
+
+        for tire, velocity, force, torque in zip(self.tires, velocities.tolist(), forces.tolist(), torques.tolist()):
+            tire.velocity = velocity
+            tire.force = force
+            tire.torque = torque
+
+    def _update_damped_bodies(self):
+        if not self.damped_bodies:
+            return
+
+        velocities = np.array(tuple(map(attrgetter('velocity'), self.damped_bodies)), dtype=np.float64)
+        angular_velocities = np.array(tuple(map(attrgetter('angular_velocity'), self.damped_bodies)), dtype=np.float64)
+
+        forces = velocities * -self.damped_body_masses[:, np.newaxis] * 0.5 + 0.0
+        torques = -self.damped_body_moments * angular_velocities * 0.5 + 0.0
+
+        # 止まっている物体の力は0のままなので、動いている物体にだけ設定します。
+        for i in np.flatnonzero(np.any(velocities != 0, axis=-1) | (angular_velocities != 0)).tolist():
+            self.damped_bodies[i].force = forces[i].tolist()
+            self.damped_bodies[i].torque = torques[i].tolist()
+
+    def _update_velocity(self, body, gravity, damping, dt):
+        pymunk.Body.update_velocity(body, gravity, damping, dt)
+
+        self._update_tires(dt)
+        self._update_damped_bodies()
+
+
 if __name__ == '__main__':
     import pygame
     import sys
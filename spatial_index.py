@@ -0,0 +1,55 @@
+from funcy import first, mapcat, second
+from itertools import product
+from math import ceil, floor, inf
+
+
+class GridIndex:
+    # 物体を位置で格子に分類して、指定した位置の近くにある物体だけを取得します。物体を移動した場合は、updateで索引を更新してください。
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+        self.cells = {}
+        self.body_cells = {}
+
+    def _get_cell(self, position):
+        return floor(position[0] / self.cell_size), floor(position[1] / self.cell_size)
+
+    def update(self, body):
+        cell = self._get_cell(body.position)
+        old_cell = self.body_cells.get(body)
+
+        if cell == old_cell:
+            return
+
+        if old_cell is not None:
+            self.cells[old_cell].remove(body)
+
+        self.cells.setdefault(cell, []).append(body)
+        self.body_cells[body] = cell
+
+    def query(self, position, distance):
+        # distance以内にある物体を含む格子の物体を返します。distanceより遠い物体も含まれるので、呼び出し側で距離を判定してください。
+        x, y = self._get_cell(position)
+        cell_count = ceil(distance / self.cell_size)
+
+        # 調べる範囲の格子の数が物体のある格子の数より多い場合は、物体のある格子を全て調べます。
+        if (cell_count * 2 + 1) ** 2 > len(self.cells):
+            return mapcat(self.cells.get, filter(lambda cell: abs(cell[0] - x) <= cell_count and abs(cell[1] - y) <= cell_count, self.cells.keys()))
+
+        return mapcat(lambda d: self.cells.get((x + d[0], y + d[1]), ()), product(range(-cell_count, cell_count + 1), repeat=2))
+
+    def query_within(self, position, distance):
+        # distance以内にある物体を、近い順に返します。
+        return tuple(map(second, sorted(filter(lambda length_and_body: length_and_body[0] <= distance, map(lambda body: ((body.position - position).length, body), self.query(position, distance))), key=first)))
+
+    def query_nearest(self, position, count, distance=inf):
+        # 近い順にcount個までの物体を返します。distance以内の物体が見つかるまで、調べる範囲を倍々に広げます。
+        search_distance = self.cell_size
+
+        while True:
+            bodies = self.query_within(position, min(search_distance, distance))
+
+            if len(bodies) >= count or len(bodies) == len(self.body_cells) or search_distance >= distance:
+                return bodies[:count]
+
+            search_distance *= 2
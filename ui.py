@@ -3,6 +3,8 @@ import pymunk.pygame_util
 import pymunk.space_debug_draw_options
 
 from funcy import count, juxt, mapcat
+from math import cos, floor, sin
+from operator import attrgetter
 from simulator import Car, Star, Tire
 
 
@@ -35,37 +37,45 @@ def _draw_poly(options, left_bottom, shape, outline_color, fill_color):
     )
 
 
-def _create_space_surface(space):
-    def get_min_max_coordinate():
-        coordinates = tuple(mapcat(lambda shape: (shape.bb.left, shape.bb.top, shape.bb.right, shape.bb.bottom), filter(lambda shape: shape.body.body_type == pymunk.Body.DYNAMIC, space.shapes)))
+def _get_car_from_shape(shape):
+    if isinstance(shape.body, Tire):
+        return shape.body.car
+
+    if isinstance(shape.body, Car):
+        return shape.body
+
+    return None
+
 
-        return juxt(max, min)(coordinates)
+def _get_color(r, g, b):
+    return pymunk.space_debug_draw_options.SpaceDebugColor(r, g, b, 255)
 
-    def get_car_from_shape(shape):
-        if isinstance(shape.body, Tire):
-            return shape.body.car
 
-        if isinstance(shape.body, Car):
-            return shape.body
+_STAR_COLOR = _get_color(128, 255, 128)
+_CAR_COLOR = _get_color(128, 128, 255)
+_CRASHED_CAR_COLOR = _get_color(255, 128, 128)
+_OTHER_COLOR = _get_color(192, 192, 192)
 
-        return None
 
-    def get_color(r, g, b):
-        return pymunk.space_debug_draw_options.SpaceDebugColor(r, g, b, 255)
+def _get_fill_color(shape):
+    if isinstance(shape.body, Star):
+        return _STAR_COLOR
 
-    def get_fill_color(shape):
-        if isinstance(shape.body, Star):
-            return get_color(128, 255, 128)
+    if _get_car_from_shape(shape):
+        if _get_car_from_shape(shape).crash_energy == 0:
+            return _CAR_COLOR
+        else:
+            return _CRASHED_CAR_COLOR
 
-        if get_car_from_shape(shape):
-            if get_car_from_shape(shape).crash_energy == 0:
-                return get_color(128, 128, 255)
-            else:
-                return get_color(255, 128, 128)
+    return _OTHER_COLOR
 
-        return get_color(192, 192, 192)
 
-    max_coordinate, min_coordinate = get_min_max_coordinate()
+def _get_min_max_coordinate(shapes):
+    return juxt(max, min)(tuple(mapcat(attrgetter('bb'), shapes)))
+
+
+def _create_space_surface(space):
+    max_coordinate, min_coordinate = _get_min_max_coordinate(filter(lambda shape: shape.body.body_type == pymunk.Body.DYNAMIC, space.shapes))
 
     size = (max_coordinate - min_coordinate, max_coordinate - min_coordinate)
     left_bottom = (min_coordinate, min_coordinate)
@@ -74,7 +84,7 @@ def _create_space_surface(space):
     options = pymunk.pygame_util.DrawOptions(surface)
 
     for shape in space.shapes:
-        fill_color = get_fill_color(shape)
+        fill_color = _get_fill_color(shape)
 
         if isinstance(shape, pymunk.shapes.Circle):
             _draw_circle(options, left_bottom, shape, fill_color, fill_color)
@@ -86,14 +96,7 @@ def _create_space_surface(space):
     return surface, *left_bottom, *size
 
 
-def create_surface(space, cars, players, actions):
-    space_surface, space_left, space_bottom, space_width, space_height = _create_space_surface(space)
-
-    surface = pygame.surface.Surface((800, 640))
-    font = pygame.font.Font(None, 24)
-
-    surface.blit(pygame.transform.smoothscale(space_surface, (640, 640)), (0, 0))
-
+def _draw_information(surface, font, cars, players, actions, space_left, space_bottom, space_width, space_height):
     pygame.draw.rect(surface, (255, 255, 255), (640, 0, 800, 640))
 
     for i, car, player, action in zip(count(), cars, players, actions):
@@ -106,4 +109,122 @@ def create_surface(space, cars, players, actions):
         for j, action_value in zip(count(), action):
             pygame.draw.rect(surface, (128, 128, 128), (640 + 24 + 50 * j, min(80 * i + 48, 80 * i + 48 - int(action_value * 20)), 30, abs(int(action_value * 20))))
 
+
+def create_surface(space, cars, players, actions):
+    space_surface, space_left, space_bottom, space_width, space_height = _create_space_surface(space)
+
+    surface = pygame.surface.Surface((800, 640))
+    font = pygame.font.Font(None, 24)
+
+    surface.blit(pygame.transform.smoothscale(space_surface, (640, 640)), (0, 0))
+
+    _draw_information(surface, font, cars, players, actions, space_left, space_bottom, space_width, space_height)
+
     return surface
+
+
+class Renderer:
+    # create_surfaceと同じ画像を、毎フレームの準備を省いて描画します。静的な物体（壁）は事前に描画しておき、サーフェスやフォント、図形の頂点は使い回します。
+    # 返すサーフェスは次の描画で上書きされるので、保存する場合はコピーしてください。
+    def __init__(self, space):
+        self.space = space
+
+        self.font = pygame.font.Font(None, 24)
+        self.surface = pygame.surface.Surface((800, 640))
+        self.scaled_space_surface = pygame.surface.Surface((640, 640))
+
+        static_shapes = tuple(filter(lambda shape: shape.body.body_type == pymunk.Body.STATIC, space.shapes))
+        self.dynamic_shapes = tuple(filter(lambda shape: shape.body.body_type == pymunk.Body.DYNAMIC, space.shapes))
+
+        # 図形毎に、描画方法と色の決め方、ローカル座標の頂点を記録しておきます。
+        self.drawings = tuple(map(self._create_drawing, self.dynamic_shapes))
+
+        # 静的な物体を囲む範囲のキャンバスを作成して、静的な物体を描画したレイヤーを保存しておきます。
+        if static_shapes:
+            max_coordinate, min_coordinate = _get_min_max_coordinate(static_shapes)
+
+            self.canvas_left_bottom = floor(min_coordinate), floor(min_coordinate)
+            self.canvas_size = int(max_coordinate - min_coordinate) + 2
+
+            self.canvas = pygame.surface.Surface((self.canvas_size, self.canvas_size))
+            self.options = pymunk.pygame_util.DrawOptions(self.canvas)
+
+            for shape in static_shapes:
+                fill_color = _get_fill_color(shape)
+
+                if isinstance(shape, pymunk.shapes.Circle):
+                    _draw_circle(self.options, self.canvas_left_bottom, shape, fill_color, fill_color)
+                elif isinstance(shape, pymunk.shapes.Segment):
+                    _draw_segment(self.options, self.canvas_left_bottom, shape, fill_color, fill_color)
+                elif isinstance(shape, pymunk.shapes.Poly):
+                    _draw_poly(self.options, self.canvas_left_bottom, shape, fill_color, fill_color)
+
+            self.static_layer = self.canvas.copy()
+
+        else:
+            self.canvas = None
+
+    @classmethod
+    def _create_drawing(cls, shape):
+        car = _get_car_from_shape(shape)
+        color = _STAR_COLOR if isinstance(shape.body, Star) else None if car else _OTHER_COLOR
+
+        if isinstance(shape, pymunk.shapes.Poly):
+            return shape, car, color, tuple(map(tuple, shape.get_vertices()))
+
+        return shape, car, color, None
+
+    def _draw_dynamic_shapes(self):
+        left, bottom = self.canvas_left_bottom
+
+        for shape, car, color, vertices in self.drawings:
+            fill_color = color or (_CAR_COLOR if car.crash_energy == 0 else _CRASHED_CAR_COLOR)
+
+            if vertices:
+                body = shape.body
+                x, y = body.position
+                c = cos(body.angle)
+                s = sin(body.angle)
+
+                self.options.draw_polygon(tuple(map(lambda v: (v[0] * c - v[1] * s + x - left, v[0] * s + v[1] * c + y - bottom), vertices)), shape.radius, fill_color, fill_color)
+
+            elif isinstance(shape, pymunk.shapes.Circle):
+                _draw_circle(self.options, self.canvas_left_bottom, shape, fill_color, fill_color)
+
+            elif isinstance(shape, pymunk.shapes.Segment):
+                _draw_segment(self.options, self.canvas_left_bottom, shape, fill_color, fill_color)
+
+    def _render_space(self):
+        max_coordinate, min_coordinate = _get_min_max_coordinate(self.dynamic_shapes)
+
+        left = int(min_coordinate - self.canvas_left_bottom[0])
+        top = self.canvas_size - int(max_coordinate - self.canvas_left_bottom[1])
+        size = int(max_coordinate - min_coordinate)
+
+        # 動的な物体がキャンバスの外に出てしまった場合は、毎回サーフェスを作成する方法で描画します。
+        if left < 0 or top < 0 or left + size > self.canvas_size or top + size > self.canvas_size:
+            space_surface, *space_rect = _create_space_surface(self.space)
+            pygame.transform.smoothscale(space_surface, (640, 640), self.scaled_space_surface)
+
+            return space_rect
+
+        # 表示する範囲だけ静的なレイヤーで消去して、動的な物体を描画します。
+        self.canvas.blit(self.static_layer, (left, top), (left, top, size, size))
+        self._draw_dynamic_shapes()
+
+        pygame.transform.smoothscale(self.canvas.subsurface((left, top, size, size)), (640, 640), self.scaled_space_surface)
+
+        return min_coordinate, min_coordinate, max_coordinate - min_coordinate, max_coordinate - min_coordinate
+
+    def create_surface(self, cars, players, actions):
+        if self.canvas:
+            space_left, space_bottom, space_width, space_height = self._render_space()
+        else:
+            space_surface, space_left, space_bottom, space_width, space_height = _create_space_surface(self.space)
+            pygame.transform.smoothscale(space_surface, (640, 640), self.scaled_space_surface)
+
+        self.surface.blit(self.scaled_space_surface, (0, 0))
+
+        _draw_information(self.surface, self.font, cars, players, actions, space_left, space_bottom, space_width, space_height)
+
+        return self.surface